@@ -1,8 +1,12 @@
 from typing import Any, Dict
 from unittest import mock
 
+import pytest
+
 from wintappy.analytics.query_analytic import (
     CARAnalytic,
+    MitreAttackCoverage,
+    QueryAnalytic,
     SigmaAnalytic,
     MITRE_CAR_TYPE,
     SIMGA_TYPE,
@@ -49,6 +53,22 @@ class TestCarAnalytic:
         }
         assert analytic.table_item() == expected_output
 
+    def test_coverage_table_items_not_shared(self) -> None:
+        analytic = CARAnalytic(
+            analytic_id='test-id',
+            analytic_template='',
+            coverage=[MitreAttackCoverage(coverage="Low", tactics=["ta-1"], technique="T1", subtechniques=["T1.001"])],
+            metadata={},
+        )
+        items = analytic.coverage_table_items()
+        assert items == [
+            {"coverage": "Low", "tactics": ["ta-1"], "technique": "T1", "subtechniques": ["001"], "id": "test-id", "uid": "test-id-T1"}
+        ]
+        items[0]["tactics"].append("ta-2")
+        items.clear()
+        assert analytic.coverage_table_items()[0]["tactics"] == ["ta-1"]
+        assert analytic.coverage[0].tactics == ["ta-1"]
+
 class TestSigmaAnalytic:
 
     def test_table_item(self) -> None:
@@ -62,3 +82,13 @@ class TestSigmaAnalytic:
         )
         assert analytic.table_item() == {}
         assert analytic.query_type == SIMGA_TYPE
+
+
+class TestQueryAnalytic:
+
+    def test_incomplete_subclass_rejected(self) -> None:
+        with pytest.raises(TypeError, match="table_item, query_type"):
+
+            class IncompleteAnalytic(QueryAnalytic):
+                def coverage_table_items(self):
+                    return []
@@ -1,6 +1,10 @@
+import pickle
 from typing import Any, Dict
 from unittest import mock
 
+import duckdb
+from jinja2 import DictLoader, Environment
+
 from wintappy.analytics.query_analytic import (
     MitreAttackCoverage,
     CARAnalytic,
@@ -10,7 +14,10 @@ from wintappy.analytics.utils import (
     format_car_analytic,
     load_all,
     load_single,
+    read_metadata_cache,
+    run_against_day,
 )
+from wintappy.database.wintap_duckdb import WintapDuckDB, WintapDuckDBOptions
 
 
 class TestSqlUtils:
@@ -95,3 +102,37 @@ class TestSqlUtils:
             coverage=[],
         )
         assert expected_output == format_car_analytic(self.test_id, my_metadata)
+
+    def test_run_against_day_isolates_failing_analytics(self, tmp_path) -> None:
+        env = Environment(
+            loader=DictLoader(
+                {
+                    "good.sql": "SELECT 'p1' as pid_hash, TIMESTAMP '2024-01-01' as first_seen",
+                    # Unions with the good analytic, but fails converting on insert
+                    "bad.sql": "SELECT 'p2' as pid_hash, 'not a time' as first_seen",
+                }
+            )
+        )
+        analytics = [
+            CARAnalytic(
+                analytic_id=name,
+                analytic_template=f"{name}.sql",
+                metadata={},
+                coverage=[],
+            )
+            for name in ["good", "bad"]
+        ]
+        db = WintapDuckDB(WintapDuckDBOptions(duckdb.connect(), str(tmp_path)))
+
+        with mock.patch.object(db, "write_table"), mock.patch.object(db, "clear_table"):
+            run_against_day(env, db, analytics, 20240101)
+
+        assert db.query("select entity, analytic_id from mitre_labels", output="relation").fetchall() == [
+            ("p1", "good")
+        ]
+
+    def test_read_metadata_cache_not_a_dict(self, tmp_path) -> None:
+        (tmp_path / "metadata").write_bytes(pickle.dumps(["not", "a", "dict"]))
+
+        with mock.patch("wintappy.analytics.utils.METADATA_CACHE_DIR", str(tmp_path)):
+            assert read_metadata_cache("metadata", sha="abc") is None
@@ -2,6 +2,7 @@ from datetime import datetime, timezone
 from unittest import mock
 
 import duckdb
+import pytest
 
 from wintappy.database.wintap_duckdb import WintapDuckDB, WintapDuckDBOptions
 
@@ -14,7 +15,9 @@ class TestWinTapDuckDB:
         wintap_db = WintapDuckDB(WintapDuckDBOptions(connection, self.dataset_path))
         wintap_db.get_tables()
         connection.execute.assert_called_with(
-            "select table_name, table_type from information_schema.tables where table_schema='main' order by all"
+            "select table_name as name from duckdb_tables() where schema_name='main' "
+            "union all select view_name from duckdb_views() where schema_name='main' and not internal "
+            "order by all"
         )
 
     @mock.patch("duckdb.DuckDBPyConnection")
@@ -24,6 +27,33 @@ class TestWinTapDuckDB:
         wintap_db.query(query)
         connection.execute.assert_called_with(query)
 
+    @mock.patch("duckdb.DuckDBPyConnection")
+    def test_query_outputs(self, connection: mock.MagicMock) -> None:
+        wintap_db = WintapDuckDB(WintapDuckDBOptions(connection, self.dataset_path))
+        query = "select 1"
+        wintap_db.query(query, output="arrow")
+        connection.execute.return_value.fetch_arrow_table.assert_called_once()
+        assert wintap_db.query(query, output="relation") == connection.sql.return_value
+        connection.sql.assert_called_with(query)
+        with pytest.raises(ValueError):
+            wintap_db.query(query, output="csv")
+
+    @mock.patch("duckdb.DuckDBPyConnection")
+    def test_execute(self, connection: mock.MagicMock) -> None:
+        wintap_db = WintapDuckDB(WintapDuckDBOptions(connection, self.dataset_path))
+        query = "DROP VIEW IF EXISTS my_view"
+        assert wintap_db.execute(query) is None
+        connection.execute.assert_called_with(query)
+        connection.execute.return_value.df.assert_not_called()
+
+    @mock.patch("duckdb.DuckDBPyConnection")
+    def test_execute_in_cursor(self, connection: mock.MagicMock) -> None:
+        wintap_db = WintapDuckDB(WintapDuckDBOptions(connection, self.dataset_path))
+        query = "select 1"
+        wintap_db.execute_in_cursor(query)
+        connection.cursor.return_value.execute.assert_called_with(query)
+        connection.cursor.return_value.close.assert_called_once()
+
     @mock.patch("duckdb.DuckDBPyConnection")
     def test_write(self, connection: mock.MagicMock) -> None:
         wintap_db = WintapDuckDB(WintapDuckDBOptions(connection, self.dataset_path))
@@ -31,7 +61,7 @@ class TestWinTapDuckDB:
         wintap_db.write_table(table_name, day_pk)
         expected_pathspec = "test/rolling/my-test-table/dayPK=202306"
         expected_filename = "my-test-table-202306.parquet"
-        sql = f"COPY {table_name} TO '{expected_pathspec}/{expected_filename}' (FORMAT 'parquet')"
+        sql = f"COPY {table_name} TO '{expected_pathspec}/{expected_filename}' (FORMAT 'parquet', COMPRESSION 'zstd', ROW_GROUP_SIZE 122880)"
         connection.execute.assert_called_with(sql)
 
     @mock.patch("datetime.datetime")
@@ -41,22 +71,65 @@ class TestWinTapDuckDB:
     ) -> None:
         wintap_db = WintapDuckDB(WintapDuckDBOptions(connection, self.dataset_path))
         mock_time = "1689378948"
-        mock_datetime.strftime.return_value = mock_time
+        mock_datetime.timestamp.return_value = float(mock_time)
         mock_analytic_id = "my-cool-analytic"
         mock_entity_type = "not_the-pid-hash"
-        expected_sql = f"INSERT INTO mitre_labels (\n    entity,\n    analytic_id,\n    time,\n    entity_type\n)\nVALUES (\n    '{mock_entity_type}',\n    '{mock_analytic_id}',\n    to_timestamp({int(mock_time)}),\n    'pid_hash'\n)"
+        expected_sql = "INSERT INTO mitre_labels (\n    entity,\n    analytic_id,\n    time,\n    entity_type\n)\nVALUES (\n    ?,\n    ?,\n    to_timestamp(?),\n    ?\n)"
         wintap_db.insert_analytics_results_table(
             mock_analytic_id,
             mock_entity_type,
             event_time=mock_datetime,
         )
-        connection.execute.assert_called_with(expected_sql)
+        connection.execute.assert_called_with(
+            expected_sql,
+            [mock_entity_type, mock_analytic_id, int(mock_time), "pid_hash"],
+        )
+
+    @mock.patch("duckdb.DuckDBPyConnection")
+    def test_insert_analytics_results_default_time(
+        self, connection: mock.MagicMock
+    ) -> None:
+        wintap_db = WintapDuckDB(WintapDuckDBOptions(connection, self.dataset_path))
+        before = int(datetime.now(timezone.utc).timestamp())
+        wintap_db.insert_analytics_results_table("my-cool-analytic", "pid-1")
+        after = int(datetime.now(timezone.utc).timestamp())
+        event_time = connection.execute.call_args.args[1][2]
+        assert before <= event_time <= after
+
+    @mock.patch("duckdb.DuckDBPyConnection")
+    def test_insert_analytics_results_bulk(self, connection: mock.MagicMock) -> None:
+        wintap_db = WintapDuckDB(WintapDuckDBOptions(connection, self.dataset_path))
+        event_time = datetime(2023, 7, 15, 0, 0, 0)
+        wintap_db.insert_analytics_results_bulk(
+            [
+                ("pid-1", "my-cool-analytic", event_time, "pid_hash"),
+                ("pid-2", "my-cool-analytic", event_time, "pid_hash"),
+            ]
+        )
+        name, batch = connection.register.call_args.args
+        assert batch.num_rows == 2
+        assert batch.column("entity").to_pylist() == ["pid-1", "pid-2"]
+        connection.execute.assert_called_with(
+            f"INSERT INTO mitre_labels SELECT entity, analytic_id, time, entity_type FROM {name}"
+        )
+        connection.unregister.assert_called_with(name)
+        wintap_db.insert_analytics_results_bulk([("pid-3", "my-cool-analytic", event_time, "pid_hash")])
+        assert connection.register.call_args.args[0] != name
+
+    def test_insert_analytics_results_bulk_inserts(self) -> None:
+        wintap_db = WintapDuckDB(WintapDuckDBOptions(duckdb.connect(), self.dataset_path))
+        event_time = datetime(2023, 7, 15, 0, 0, 0)
+        wintap_db.insert_analytics_results_bulk([("pid-1", "my-cool-analytic", event_time, "pid_hash")])
+        assert wintap_db.query("select * from mitre_labels", output="relation").fetchall() == [
+            ("pid-1", "my-cool-analytic", event_time, "pid_hash")
+        ]
+        assert "analytics_results_batch" not in " ".join(wintap_db.get_tables())
 
     @mock.patch("duckdb.DuckDBPyConnection")
     def test_is_not_table_or_view(self, connection: mock.MagicMock) -> None:
         wintap_db = WintapDuckDB(WintapDuckDBOptions(connection, self.dataset_path))
         # do this after the setup in order to isolate the is table check
-        connection.execute.side_effect = duckdb.CatalogException("whoops!")
+        connection.execute.return_value.fetchone.return_value = None
         assert wintap_db._is_table_or_view('my-table') == False
 
     @mock.patch("duckdb.DuckDBPyConnection")
@@ -0,0 +1,159 @@
+import os
+
+import duckdb
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from wintappy.datautils.rawutil import (
+    create_views,
+    get_daypk_filter,
+    get_glob_paths_for_dataset,
+    get_globs_for,
+    write_parquet,
+)
+
+
+class TestRawUtil:
+    def test_get_globs_for_removes_bad_files(self, tmp_path) -> None:
+        day_dir = tmp_path / "raw_sensor" / "raw_process" / "dayPK=20240101"
+        day_dir.mkdir(parents=True)
+        pq.write_table(pa.table({"pid": [1, 2]}), day_dir / "full.parquet")
+        pq.write_table(pa.table({"pid": pa.array([], pa.int64())}), day_dir / "empty.parquet")
+        (day_dir / "bad.parquet").write_text("not parquet")
+
+        globs = get_globs_for(str(tmp_path), "20240101")
+
+        assert globs == {
+            "raw_process": os.path.join(str(tmp_path), "raw_sensor", "raw_process", "dayPK=20240101", "*.parquet")
+        }
+        assert sorted(os.listdir(day_dir)) == ["bad.parquet.invalid", "full.parquet"]
+
+    def test_get_globs_for_all_empty(self, tmp_path) -> None:
+        day_dir = tmp_path / "raw_sensor" / "raw_process" / "dayPK=20240101"
+        day_dir.mkdir(parents=True)
+        pq.write_table(pa.table({"pid": pa.array([], pa.int64())}), day_dir / "empty.parquet")
+
+        assert get_globs_for(str(tmp_path), "20240101") == {}
+
+    def test_get_glob_paths_for_dataset(self, tmp_path) -> None:
+        raw_sensor = tmp_path / "raw_sensor"
+        for leaf in ["raw_process/dayPK=20240101/hourPK=01", "raw_process/dayPK=20240102/hourPK=00", "raw_file"]:
+            (raw_sensor / leaf).mkdir(parents=True)
+            pq.write_table(pa.table({"pid": [1]}), raw_sensor / leaf / "data.parquet")
+
+        assert get_glob_paths_for_dataset(str(tmp_path)) == {
+            "raw_process": os.path.join(str(raw_sensor), "raw_process", "*", "*", "*.parquet"),
+            "raw_file": os.path.join(str(raw_sensor), "raw_file", "*.parquet"),
+        }
+
+    def test_get_daypk_filter(self) -> None:
+        assert get_daypk_filter() == ""
+        assert get_daypk_filter("", "") == ""
+        assert get_daypk_filter("20240101") == "where dayPK = 20240101"
+        assert get_daypk_filter("20240101", "20240102") == "where dayPK between 20240101 and 20240102"
+        with pytest.raises(ValueError):
+            get_daypk_filter("20240101; drop table x")
+
+    def test_create_views_raw_sensor_day_filter(self, tmp_path) -> None:
+        raw_process = tmp_path / "raw_sensor" / "raw_process"
+        for day in ["20240101", "20240102", "20240103"]:
+            (raw_process / f"dayPK={day}").mkdir(parents=True)
+            pq.write_table(pa.table({"PidHash": [day]}), raw_process / f"dayPK={day}" / "data.parquet")
+        con = duckdb.connect()
+
+        create_views(con, {"raw_process": str(raw_process / "*" / "*.parquet")}, "20240102", "20240103")
+
+        assert con.execute("select PidHash from raw_process order by all").fetchall() == [("20240102",), ("20240103",)]
+
+    def test_create_views_csv_lookup_replaces_view(self, tmp_path) -> None:
+        lookup = tmp_path / "hosts.csv"
+        lookup.write_text("hostname,owner\nhost-01,alice\n")
+        con = duckdb.connect()
+        con.execute("create view hosts as select 1 x")
+
+        create_views(con, {"hosts": str(lookup)})
+
+        assert con.execute("select table_type from information_schema.tables where table_name = 'hosts'").fetchall() == [
+            ("BASE TABLE",)
+        ]
+        assert con.execute("select * from hosts").fetchall() == [("host-01", "alice")]
+
+    def test_create_views_csv_lookup_twice(self, tmp_path) -> None:
+        lookup = tmp_path / "hosts.csv"
+        lookup.write_text("hostname,owner\nhost-01,alice\n")
+        con = duckdb.connect(str(tmp_path / "lookups.db"))
+
+        create_views(con, {"hosts": str(lookup)})
+        lookup.write_text("hostname,owner\nhost-01,bob\n")
+        create_views(con, {"hosts": str(lookup)})
+
+        assert con.execute("select * from hosts").fetchall() == [("host-01", "bob")]
+
+    def test_write_parquet(self, tmp_path) -> None:
+        con = duckdb.connect()
+        con.execute("create table process as select 1 pid; create view process_summary as select 2 pid")
+
+        write_parquet(con, str(tmp_path), ["process", "process_summary", "raw_memorymap"], daypk=20240101)
+
+        for name, pid in [("process", 1), ("process_summary", 2)]:
+            path = tmp_path / "rolling" / name / "dayPK=20240101" / f"{name}-20240101.parquet"
+            assert pq.read_table(path).to_pydict() == {"pid": [pid]}
+
+    def test_get_glob_paths_for_dataset_mixed_depths(self, tmp_path) -> None:
+        raw_process = tmp_path / "raw_sensor" / "raw_process"
+        for leaf in ["a", "b/c"]:
+            (raw_process / leaf).mkdir(parents=True)
+            pq.write_table(pa.table({"pid": [1]}), raw_process / leaf / "data.parquet")
+
+        with pytest.raises(Exception, match="Too many leaf dirs"):
+            get_glob_paths_for_dataset(str(tmp_path))
+
+    def test_get_glob_paths_for_dataset_mixed_hive_depths(self, tmp_path) -> None:
+        raw_process = tmp_path / "raw_sensor" / "raw_process"
+        for leaf in ["dayPK=20240101", "dayPK=20240102/hourPK=00"]:
+            (raw_process / leaf).mkdir(parents=True)
+            pq.write_table(pa.table({"pid": [1]}), raw_process / leaf / "data.parquet")
+
+        with pytest.raises(Exception, match="Too many leaf dirs"):
+            get_glob_paths_for_dataset(str(tmp_path))
+
+    def test_get_glob_paths_for_dataset_empty_partition(self, tmp_path) -> None:
+        raw_process = tmp_path / "raw_sensor" / "raw_process"
+        (raw_process / "dayPK=20240100").mkdir(parents=True)
+        (raw_process / "dayPK=20240101" / "hourPK=00").mkdir(parents=True)
+        pq.write_table(pa.table({"pid": [1]}), raw_process / "dayPK=20240101" / "hourPK=00" / "data.parquet")
+
+        assert get_glob_paths_for_dataset(str(tmp_path)) == {
+            "raw_process": os.path.join(str(raw_process), "*", "*", "*.parquet"),
+        }
+
+    def test_write_parquet_partition_by(self, tmp_path) -> None:
+        con = duckdb.connect()
+        con.execute("create table process as select * from (values (1, 20240101), (2, 20240102)) t(pid, dayPK)")
+
+        write_parquet(con, str(tmp_path), ["process"], partition_by="dayPK")
+
+        assert sorted(os.listdir(tmp_path / "rolling" / "process")) == ["dayPK=20240101", "dayPK=20240102"]
+        assert con.execute(
+            f"select pid, dayPK from parquet_scan('{tmp_path}/rolling/process/*/*.parquet', hive_partitioning=1) order by all"
+        ).fetchall() == [(1, 20240101), (2, 20240102)]
+
+    def test_write_parquet_rewrites_partitions(self, tmp_path) -> None:
+        con = duckdb.connect()
+        con.execute("create table process as select 1 pid")
+        write_parquet(con, str(tmp_path), ["process"], daypk=20240101)
+        con.execute("create or replace table process as select * from (values (1, 20240101), (2, 20240102)) t(pid, dayPK)")
+
+        write_parquet(con, str(tmp_path), ["process"], partition_by="dayPK")
+        write_parquet(con, str(tmp_path), ["process"], partition_by="dayPK")
+
+        assert os.listdir(tmp_path / "rolling" / "process" / "dayPK=20240101") == ["process-0.parquet"]
+        assert con.execute(
+            f"select pid, dayPK from parquet_scan('{tmp_path}/rolling/process/*/*.parquet', hive_partitioning=1) order by all"
+        ).fetchall() == [(1, 20240101), (2, 20240102)]
+
+        con.execute("create or replace table process as select 3 pid")
+        write_parquet(con, str(tmp_path), ["process"], daypk=20240102)
+
+        assert os.listdir(tmp_path / "rolling" / "process" / "dayPK=20240102") == ["process-20240102.parquet"]
@@ -0,0 +1,72 @@
+import os
+
+import duckdb
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from wintappy.datautils.rawutil import create_views
+from wintappy.datautils.stdview_duckdb import duckdb_table_metadata, glob_size
+
+
+class TestStdviewDuckdb:
+    def test_glob_size_skips_stray_files(self, tmp_path) -> None:
+        raw_process = tmp_path / "raw_process"
+        for day in ["dayPK=20240101", "dayPK=20240102"]:
+            (raw_process / day).mkdir(parents=True)
+            pq.write_table(pa.table({"pid": [1]}), raw_process / day / "data.parquet")
+        (raw_process / "README").write_text("not a partition")
+        (raw_process / "_SUCCESS").write_text("")
+        (raw_process / "dayPK=20240101" / ".hidden.parquet").write_text("")
+
+        size, files = glob_size(os.path.join(str(raw_process), "*", "*.parquet"))
+
+        assert files == 2
+        assert size == sum(
+            os.path.getsize(raw_process / day / "data.parquet")
+            for day in ["dayPK=20240101", "dayPK=20240102"]
+        )
+
+
+    def write_rolling_process(self, tmp_path) -> str:
+        process = tmp_path / "rolling" / "process"
+        for day, pids in [("20240101", [1, 2]), ("20240102", [3])]:
+            (process / f"dayPK={day}").mkdir(parents=True)
+            pq.write_table(pa.table({"pid": pids}), process / f"dayPK={day}" / "data.parquet")
+        return os.path.join(str(process), "*", "*.parquet")
+
+    def test_table_metadata_from_footers(self, tmp_path) -> None:
+        glob = self.write_rolling_process(tmp_path)
+        con = duckdb.connect()
+        create_views(con, {"process": glob})
+
+        metadata = duckdb_table_metadata(con, True, {"process": glob})
+
+        assert metadata.to_dict("records") == [
+            {"Table_Name": "process", "Min_DayPK": 20240101, "Max_DayPK": 20240102, "Num_Rows": 3}
+        ]
+
+    def test_table_metadata_filtered_view(self, tmp_path) -> None:
+        glob = self.write_rolling_process(tmp_path)
+        con = duckdb.connect()
+        create_views(con, {"process": glob}, "20240102")
+
+        metadata = duckdb_table_metadata(con, True, {"process": glob})
+
+        assert metadata.to_dict("records") == [
+            {"Table_Name": "process", "Min_DayPK": 20240102, "Max_DayPK": 20240102, "Num_Rows": 1}
+        ]
+
+    def test_table_metadata_unpartitioned_file(self, tmp_path) -> None:
+        stdview = tmp_path / "stdview"
+        stdview.mkdir()
+        pq.write_table(pa.table({"pid": [1, 2, 3], "dayPK": [20240101, 20240102, 20240103]}), stdview / "process.parquet")
+        glob = str(stdview / "process.parquet")
+        con = duckdb.connect()
+        create_views(con, {"process": glob})
+
+        metadata = duckdb_table_metadata(con, True, {"process": glob})
+
+        assert metadata.to_dict("records") == [
+            {"Table_Name": "process", "Min_DayPK": 20240101, "Max_DayPK": 20240103, "Num_Rows": 3}
+        ]
+
@@ -0,0 +1,71 @@
+import json
+from datetime import datetime, timezone
+from unittest import mock
+
+import pytest
+
+from wintappy.etlutils.downloadfroms3 import (
+    MAX_RETRIES,
+    FailureLog,
+    S3File,
+    download_files_threaded,
+    parse_filename,
+    process_client_kwargs,
+)
+
+
+class TestDownloadFromS3:
+    def test_parse_filename_new_format(self) -> None:
+        assert parse_filename("host-01+raw_process+1704067200.parquet") == (
+            "host-01",
+            "1704067200",
+        )
+
+    def test_parse_filename_new_format_hyphenated_event(self) -> None:
+        assert parse_filename("host-01+raw_process-stop+1704067200.parquet") == (
+            "host-01",
+            "1704067200",
+        )
+
+    def test_parse_filename_legacy_format(self) -> None:
+        assert parse_filename("host-01=raw_process-1704070900.parquet") == (
+            "host-01",
+            "1704070900",
+        )
+
+    def test_parse_filename_unrecognized(self) -> None:
+        with pytest.raises(ValueError):
+            parse_filename("not_a_wintap_file.parquet")
+
+    @mock.patch("wintappy.etlutils.downloadfroms3.download_one_file")
+    def test_download_failures_logged_per_attempt(self, download_one_file: mock.MagicMock, tmp_path) -> None:
+        download_one_file.side_effect = OSError("connection reset")
+        s3_file = S3File(
+            key="raw_process/host-01+raw_process+1704067200.parquet",
+            filename="host-01+raw_process+1704067200.parquet",
+            s3_path="raw_process",
+            hostname="host-01",
+            data_capture_ts=datetime(2024, 1, 1, tzinfo=timezone.utc),
+            uploadedDPK="20240101",
+            uploadedHPK="00",
+            dataDPK="20240101",
+            dataHPK="00",
+            local_file_path=str(tmp_path / "raw_process"),
+            os="windows",
+            sensor_version="1",
+            event_type="raw_process",
+        )
+        failure_log = FailureLog(str(tmp_path / "failed.jsonl"))
+
+        download_files_threaded("bucket", mock.MagicMock(), [s3_file], failure_log=failure_log)
+
+        lines = [json.loads(line) for line in (tmp_path / "failed.jsonl").read_text().splitlines()]
+        assert [line["retry_attempt"] for line in lines] == list(range(MAX_RETRIES + 1))
+        assert {line["key"] for line in lines} == {s3_file.key}
+
+
+    def test_process_client_kwargs_without_credentials(self) -> None:
+        session = mock.MagicMock()
+        session.get_credentials.return_value = None
+
+        assert process_client_kwargs(session, "us-west-2") == {"region_name": "us-west-2"}
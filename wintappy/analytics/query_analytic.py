@@ -1,14 +1,14 @@
-from abc import ABC, abstractmethod
-from dataclasses import asdict, dataclass
-from typing import Any, Dict, List, Optional
+from dataclasses import dataclass, field
+from typing import Any, ClassVar, Dict, List, Optional
 
+from jinja2 import Template
 from pandas import DataFrame
 
 MITRE_CAR_TYPE = "MITRE_CAR"
 SIMGA_TYPE = "SIGMA"
 
 
-@dataclass
+@dataclass(slots=True)
 class MitreAttackCoverage:
     coverage: str
     tactics: List[str]
@@ -16,12 +16,16 @@ class MitreAttackCoverage:
     subtechniques: Optional[List[str]] = None
 
 
-@dataclass
-class QueryAnalytic(ABC):
+@dataclass(slots=True)
+class QueryAnalytic:
     analytic_id: str
     analytic_template: str
     metadata: Dict[str, Any]
     coverage: List[MitreAttackCoverage]
+    # Compiled once when loaded so each run doesn't go back through the jinja loader
+    compiled_template: Optional[Template] = field(
+        default=None, init=False, compare=False, repr=False
+    )
 
     def get_tactics(self) -> List[str]:
         """Helper function to quickly return all tactics in coverage"""
@@ -37,46 +41,64 @@ class QueryAnalytic(ABC):
             techniques.append(c.technique)
         return techniques
 
-    @property
-    @abstractmethod
-    def query_type(self) -> str:
-        pass
+    # Set by each analytic type. A plain base class rather than an ABC, so instance checks
+    # and method lookups skip the abstract machinery.
+    query_type: ClassVar[str]
+
+    def __init_subclass__(cls, **kwargs) -> None:
+        # Stands in for the ABC check, at class definition rather than instantiation.
+        # Explicit super, slots=True rebuilds the class and leaves the __class__ cell stale.
+        super(QueryAnalytic, cls).__init_subclass__(**kwargs)
+        missing = [
+            name
+            for name in ("table_item", "coverage_table_items")
+            if getattr(cls, name) is getattr(QueryAnalytic, name)
+        ]
+        if not hasattr(cls, "query_type"):
+            missing.append("query_type")
+        if missing:
+            raise TypeError(f"{cls.__name__} must define {', '.join(missing)}")
 
-    @abstractmethod
     def table_item(self) -> Dict[str, Any]:
-        pass
+        raise NotImplementedError
 
-    @abstractmethod
     def coverage_table_items(self) -> List[Dict[str, Any]]:
-        pass
+        raise NotImplementedError
 
 
-@dataclass
+@dataclass(slots=True)
 class CARAnalytic(QueryAnalytic):
     query_type = MITRE_CAR_TYPE
 
     def table_item(self) -> Dict[str, Any]:
-        data = self.metadata
-        data.pop("implementations", None)
-        data.pop("unit_tests", None)
-        return data
+        # copy rather than pop, the metadata is shared with the loaded CAR metadata
+        return {
+            k: v
+            for k, v in self.metadata.items()
+            if k not in ("implementations", "unit_tests")
+        }
 
     def coverage_table_items(self) -> List[Dict[str, Any]]:
-        data = []
-        for entry in self.coverage:
-            single_entry = asdict(entry)
-            single_entry["id"] = self.analytic_id
-            single_entry["uid"] = f"{self.analytic_id}-{entry.technique}"
-            single_entry["subtechniques"] = (
-                list(map(lambda x: x.split(".")[-1], entry.subtechniques))
-                if entry.subtechniques
-                else []
-            )
-            data.append(single_entry)
-        return data
-
-
-@dataclass
+        # Built fresh on each call so callers can't change what the next caller sees.
+        # Literal dicts rather than asdict, which deep copies by reflection.
+        return [
+            {
+                "coverage": entry.coverage,
+                "tactics": list(entry.tactics),
+                "technique": entry.technique,
+                "subtechniques": (
+                    [x.split(".")[-1] for x in entry.subtechniques]
+                    if entry.subtechniques
+                    else []
+                ),
+                "id": self.analytic_id,
+                "uid": f"{self.analytic_id}-{entry.technique}",
+            }
+            for entry in self.coverage
+        ]
+
+
+@dataclass(slots=True)
 class SigmaAnalytic(QueryAnalytic):
     query_type = SIMGA_TYPE
 
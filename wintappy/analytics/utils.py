@@ -1,18 +1,17 @@
 import logging
 import os
-import shutil
-import tempfile
+import pickle
+import time
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from functools import partial
-from typing import Any, Dict, List, Optional
+from types import MappingProxyType
+from typing import TYPE_CHECKING, Any, Dict, List, Mapping, Optional
 
+import duckdb
 import fsspec
 import tqdm
-import yaml
-from duckdb import CatalogException, ParserException
 from jinja2 import Environment
-from mitreattack.stix20 import MitreAttackData
 
+from .. import VERSION
 from ..database.constants import CAR_ANALYTICS_RESULTS_TABLE
 from ..database.wintap_duckdb import WintapDuckDB
 from .constants import (
@@ -28,11 +27,33 @@ from .constants import (
 )
 from .query_analytic import CARAnalytic, MitreAttackCoverage
 
+if TYPE_CHECKING:
+    # mitreattack pulls in stix2 and friends, only import it once ATT&CK data is needed
+    from mitreattack.stix20 import MitreAttackData
+
+try:
+    # optional, parses the multi-megabyte ATT&CK bundle several times faster than json
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
 MITRE_CAR_PATH = "mitre_car"
 # Maximum fsspec.get threads
 MAX_WORKERS = 32
 # Maximum number of retries for failed fsspec.get
 MAX_RETRIES = 3
+# Maximum analytics run concurrently when they have to be run individually
+ANALYTIC_WORKERS = min(8, os.cpu_count() or 1)
+# Local cache of the GitHub metadata, reused across runs
+METADATA_CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "wintappy"
+)
+CAR_METADATA_CACHE = "car_metadata.pkl"
+ATTACK_METADATA_CACHE = "attack_data.pkl"
+# Within this many seconds the cache is used without checking GitHub for changes
+METADATA_CACHE_TTL = 24 * 60 * 60
+# Metadata already loaded by this process, keyed by cache name
+_loaded_metadata: Dict[str, Any] = {}
 
 
 def convert_analytic_to_sql_filename(raw_id: str) -> str:
@@ -50,94 +71,167 @@ def convert_id_to_filename(raw_id: str, filetype: str) -> str:
 ## Analytics Helpers
 
 
-def download_one_file(fs: Any, target: str, filename: str) -> None:
-    """
-    Get a single file from fsspec filesystem
-    Args:
-        fs (Any): filesystem instance
-        filename (str): filename to download
-        tmp_dir (str): target directory to copy to
-    """
-    fs.get(filename, f"{target}{os.sep}{filename}")
-
-
 def get_files(
-    fs: Any, target: str, filenames: List[str], retry_attempt: int = 0
-) -> None:
+    fs: Any, filenames: List[str], retry_attempt: int = 0
+) -> Dict[str, bytes]:
     """
-    Get files from fsspec filesystem into the provided target path.
+    Read files from fsspec filesystem into memory, keyed by filename.
     Multi-threaded, TQDM progress output.
     """
-
-    # The fs client and target is shared between threads
-    func = partial(download_one_file, fs, target)
-
+    contents: Dict[str, bytes] = {}
     # List for storing possible failed gets
     failed_downloads = []
 
     with tqdm.tqdm(desc="Getting files from filesystem", total=len(filenames)) as pbar:
-        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        with ThreadPoolExecutor(
+            max_workers=max(1, min(MAX_WORKERS, len(filenames)))
+        ) as executor:
+            # The fs client is shared between threads
             # Using a dict for preserving the file for each future, to store it as a failure if we need that
             futures = {
-                executor.submit(func, filename): filename for filename in filenames
+                executor.submit(fs.cat_file, filename): filename
+                for filename in filenames
             }
             for future in as_completed(futures):
                 if future.exception():
                     failed_downloads.append(futures[future])
                     logging.error(future.exception())
+                else:
+                    contents[futures[future]] = future.result()
                 pbar.update(1)
     if len(failed_downloads) > 0:
         if retry_attempt < MAX_RETRIES:
             logging.warning(
                 f"  {len(failed_downloads)} downloads have failed. Retrying."
             )
-            get_files(fs, target, failed_downloads, retry_attempt + 1)
+            contents.update(get_files(fs, failed_downloads, retry_attempt + 1))
         else:
-            logging.warning(
-                f"  {len(failed_downloads)} files have failed. Writing to CSV."
+            logging.warning(f"  {len(failed_downloads)} files have failed.")
+    # keep the caller's order so results don't depend on thread timing
+    return {f: contents[f] for f in filenames if f in contents}
+
+
+def read_metadata_cache(name: str, sha: Optional[str] = None) -> Optional[Any]:
+    """
+    Read cached metadata. Without a sha the cache is only used if it was written or
+    validated within METADATA_CACHE_TTL, with a sha it is used if it was built from that sha.
+    Caches written by a different wintappy version are ignored.
+    """
+    path = os.path.join(METADATA_CACHE_DIR, name)
+    try:
+        if sha is None and time.time() - os.path.getmtime(path) > METADATA_CACHE_TTL:
+            return None
+        with open(path, "rb") as f:
+            cached = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as err:
+        logging.warning(f"ignoring unreadable metadata cache {path}: {err}")
+        return None
+    if not isinstance(cached, dict):
+        logging.warning(f"ignoring malformed metadata cache {path}")
+        return None
+    if cached.get("version") != VERSION:
+        return None
+    if sha is not None:
+        if cached.get("sha") != sha:
+            return None
+        # still current, restart the TTL
+        os.utime(path)
+    return cached.get("data")
+
+
+def write_metadata_cache(name: str, sha: str, data: Any) -> None:
+    path = os.path.join(METADATA_CACHE_DIR, name)
+    try:
+        os.makedirs(METADATA_CACHE_DIR, exist_ok=True)
+        # write then rename so a concurrent reader never sees a partial file
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(
+                {"sha": sha, "ts": time.time(), "version": VERSION, "data": data},
+                f,
+                protocol=pickle.HIGHEST_PROTOCOL,
             )
+        os.replace(tmp_path, path)
+    except OSError as err:
+        logging.warning(f"unable to write metadata cache {path}: {err}")
 
 
-def load_single(analytic_id: str) -> Optional[CARAnalytic]:
-    metadata = load_car_analtyic_metadata()
+def load_single(analytic_id: str, refresh: bool = False) -> Optional[CARAnalytic]:
+    metadata = load_car_analtyic_metadata(refresh)
     return format_car_analytic(analytic_id, metadata)
 
 
-def load_all(env: Environment) -> Dict[str, CARAnalytic]:
+def load_all(env: Environment, refresh: bool = False) -> Dict[str, CARAnalytic]:
     analytics: Dict[str, CARAnalytic] = {}
-    metadata = load_car_analtyic_metadata()
-    logging.debug(f"templates({len(env.list_templates())}): {env.list_templates()}")
-    for template in env.list_templates():
-        if template.endswith(".sql"):
-            analytic_id = template.removesuffix(".sql")
-            if analytic_id in metadata:
-                analytics[analytic_id] = format_car_analytic(analytic_id, metadata)
+    metadata = load_car_analtyic_metadata(refresh)
+    templates = env.list_templates(extensions=["sql"])
+    logging.debug(f"templates({len(templates)}): {templates}")
+    # only templates with CAR metadata are analytics
+    matched = {t.removesuffix(".sql") for t in templates} & metadata.keys()
+    for analytic_id in sorted(matched):
+        analytic = format_car_analytic(analytic_id, metadata)
+        analytic.compiled_template = env.get_template(analytic.analytic_template)
+        analytics[analytic_id] = analytic
     return analytics
 
 
-def load_car_analtyic_metadata() -> Dict[str, Dict[str, Any]]:
+def load_car_analtyic_metadata(
+    refresh: bool = False,
+) -> Mapping[str, Dict[str, Any]]:
+    """
+    Load the CAR analytic metadata, keyed by analytic id. Loaded once per process, the
+    result is read-only since it is shared between callers.
+    """
+    if refresh or CAR_METADATA_CACHE not in _loaded_metadata:
+        _loaded_metadata[CAR_METADATA_CACHE] = MappingProxyType(
+            fetch_car_analytic_metadata(refresh)
+        )
+    return _loaded_metadata[CAR_METADATA_CACHE]
+
+
+def fetch_car_analytic_metadata(refresh: bool = False) -> Dict[str, Dict[str, Any]]:
+    if not refresh:
+        cached = read_metadata_cache(CAR_METADATA_CACHE)
+        if cached is not None:
+            return cached
+    import yaml
+
+    try:
+        # libyaml backed loader, much faster than the pure python one
+        from yaml import CSafeLoader as YamlLoader
+    except ImportError:
+        from yaml import SafeLoader as YamlLoader
+
     # list to hold analytic data
     analytics = {}
-    # create temporary dir
-    tmp_dir = f"{tempfile.mkdtemp()}"
-    # clone car data into the temporary dir
+    # read the car analytic definitions straight into memory
     fs = fsspec.filesystem("github", org=CAR_REPO_OWNER, repo=CAR_REPO_NAME)
-    get_files(fs, tmp_dir, fs.ls(ANALYTICS_DIR))
+    # the tree sha of the analytics dir changes whenever any definition does
+    sha = fs.info(ANALYTICS_DIR)["sha"]
+    if not refresh:
+        cached = read_metadata_cache(CAR_METADATA_CACHE, sha)
+        if cached is not None:
+            return cached
+    files = get_files(
+        fs, [f for f in fs.ls(ANALYTICS_DIR, detail=False) if f.endswith(".yaml")]
+    )
     # load yaml files into list of dictionaries
-    for f in os.scandir(f"{tmp_dir}{os.sep}{ANALYTICS_DIR}"):
-        if f.is_file() and f.name.endswith("yaml"):
-            with open(f.path, "r", encoding="utf-8") as single:
-                try:
-                    raw_yaml = yaml.safe_load(single)
-                    analytics[raw_yaml[ID]] = raw_yaml
-                except yaml.YAMLError as err:
-                    logging.error("error loading car analytic file: %s", f.path)
-    # remove temporary dir
-    shutil.rmtree(tmp_dir)
+    for path, raw in files.items():
+        try:
+            # libyaml decodes utf-8 itself, so hand it bytes
+            raw_yaml = yaml.load(raw, Loader=YamlLoader)
+            analytics[raw_yaml[ID]] = raw_yaml
+        except yaml.YAMLError as err:
+            logging.error("error loading car analytic file: %s", path)
+    write_metadata_cache(CAR_METADATA_CACHE, sha, analytics)
     return analytics
 
 
-def format_car_analytic(analytic_id: str, metadata: Dict[str, Any]) -> CARAnalytic:
+def format_car_analytic(
+    analytic_id: str, metadata: Mapping[str, Dict[str, Any]]
+) -> CARAnalytic:
     # format coverage as expected
     coverage = []
     for entry in metadata.get(analytic_id, {}).get(COVERAGE, []):
@@ -157,20 +251,58 @@ def run_against_day(
     daypk: Optional[int] = None,
 ) -> None:
     """Runs a single or all CAR analytics against data for a single daypk."""
+    selects = {}
     for analytic in analytics:
-        query_str = env.get_template(analytic.analytic_template).render(
-            {"search_day_pk": daypk}
+        template = analytic.compiled_template or env.get_template(
+            analytic.analytic_template
         )
-        try:
-            logging.debug(f"query string: {query_str}")
-            db.query(
-                f"INSERT INTO {CAR_ANALYTICS_RESULTS_TABLE} SELECT pid_hash, '{analytic.analytic_id}', first_seen, 'pid_hash' FROM ( {query_str} )"
+        query_str = template.render({"search_day_pk": daypk})
+        logging.debug("query string: %s", query_str)
+        selects[analytic.analytic_id] = (
+            f"SELECT pid_hash, '{analytic.analytic_id}', first_seen, 'pid_hash' FROM ( {query_str} )"
+        )
+    try:
+        # Run all analytics in a single statement so DuckDB plans them once.
+        if selects:
+            db.execute(
+                f"INSERT INTO {CAR_ANALYTICS_RESULTS_TABLE} {' UNION ALL '.join(selects.values())}"
             )
-        except (CatalogException, ParserException) as err:
-            # Don't include the stacktrace to keep the output succinct.
-            logging.error(f"{analytic.analytic_id}: {err.args}", stack_info=False)
-            logging.error(
-                f"INSERT INTO {CAR_ANALYTICS_RESULTS_TABLE} SELECT pid_hash, '{analytic.analytic_id}', first_seen, 'pid_hash' FROM ( {query_str} )"
+    except duckdb.Error as err:
+        # At least one analytic doesn't apply to this data (missing table or column, or a
+        # result that doesn't union with the others). The statement inserted nothing, so run
+        # them individually to keep the ones that do. Each runs on its own cursor, so DuckDB
+        # executes them concurrently.
+        logging.debug("combined analytics insert failed, running individually: %s", err)
+        with ThreadPoolExecutor(
+            max_workers=min(ANALYTIC_WORKERS, len(selects))
+        ) as executor:
+            futures = {
+                analytic_id: executor.submit(
+                    db.execute_in_cursor,
+                    f"INSERT INTO {CAR_ANALYTICS_RESULTS_TABLE} {select}",
+                )
+                for analytic_id, select in selects.items()
+            }
+        failed = []
+        for analytic_id, future in futures.items():
+            try:
+                future.result()
+            except duckdb.Error as err:
+                failed.append(analytic_id)
+                # Don't include the stacktrace to keep the output succinct.
+                logging.error("%s: %s", analytic_id, err.args, stack_info=False)
+                logging.error(
+                    "INSERT INTO %s %s",
+                    CAR_ANALYTICS_RESULTS_TABLE,
+                    selects[analytic_id],
+                )
+        if failed:
+            logging.warning(
+                "%s of %s analytics failed for dayPK %s: %s",
+                len(failed),
+                len(selects),
+                daypk,
+                ", ".join(failed),
             )
     # write results out to the fs
     db.write_table(CAR_ANALYTICS_RESULTS_TABLE, daypk, location=db._dataset_path)
@@ -180,18 +312,38 @@ def run_against_day(
 
 
 ## MITRE ATT&CK utils
-def load_attack_metadata() -> MitreAttackData:
-    # create temporary dir
-    tmp_dir = f"{tempfile.mkdtemp()}"
-    # clone attack data into the temporary dir
-    fs = fsspec.filesystem(
-        "github", org=ATTACK_STIX_REPO_OWNER, repo=ATTACK_STIX_REPO_NAME
-    )
-    get_files(fs, tmp_dir, fs.ls(ENTERPRISE_DIRECTORY))
-    # load matrix stiix data
-    data = MitreAttackData(
-        f"{tmp_dir}{os.sep}{ENTERPRISE_DIRECTORY}{os.sep}{LATEST_ENTERPRISE_DEFINITION}"
-    )
-    # remove temporary dir
-    shutil.rmtree(tmp_dir)
-    return data
+def load_attack_metadata(refresh: bool = False) -> "MitreAttackData":
+    """
+    Load the latest enterprise ATT&CK data. Loaded once per process and shared between callers.
+    """
+    if refresh or ATTACK_METADATA_CACHE not in _loaded_metadata:
+        _loaded_metadata[ATTACK_METADATA_CACHE] = fetch_attack_metadata(refresh)
+    return _loaded_metadata[ATTACK_METADATA_CACHE]
+
+
+def fetch_attack_metadata(refresh: bool = False) -> "MitreAttackData":
+    # the directory holds every released version, only the latest definition is loaded
+    path = f"{ENTERPRISE_DIRECTORY}/{LATEST_ENTERPRISE_DEFINITION}"
+    # the parsed data is cached rather than the json, so warm starts skip building the
+    # stix objects altogether
+    attack_data = None if refresh else read_metadata_cache(ATTACK_METADATA_CACHE)
+    if attack_data is None:
+        fs = fsspec.filesystem(
+            "github", org=ATTACK_STIX_REPO_OWNER, repo=ATTACK_STIX_REPO_NAME
+        )
+        sha = fs.info(path)["sha"]
+        if not refresh:
+            attack_data = read_metadata_cache(ATTACK_METADATA_CACHE, sha)
+        if attack_data is None:
+            from mitreattack.stix20 import MitreAttackData
+            from stix2 import MemoryStore
+
+            files = get_files(fs, [path])
+            if path not in files:
+                raise FileNotFoundError(f"unable to fetch ATT&CK definition: {path}")
+            # load matrix stix data directly from memory
+            attack_data = MitreAttackData(
+                src=MemoryStore(stix_data=json_loads(files[path]))
+            )
+            write_metadata_cache(ATTACK_METADATA_CACHE, sha, attack_data)
+    return attack_data
@@ -109,7 +109,9 @@ class EnvironmentConfig:
         options, _ = self.parser.parse_known_args(argv)
         settings.update({k: v for k, v in vars(options).items() if v is not None})
         self._validate_settings(settings)
-        logging.debug(inspect_settings(settings))
+        # inspect_settings walks the whole settings tree, only pay for it when debugging
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug(inspect_settings(settings))
         return settings
 
     def _validate_settings(self, args):
@@ -9,5 +9,13 @@ LOOKUPS_DIR = "lookups"
 MITRE_DIR = "mitre"
 CREATE_ANALYTICS_RESULTS_TEMPLATE = "create_analytics_results.sql"
 INSERT_ANALYTICS_RESULTS_TEMPLATE = "insert_analytics_results.sql"
+# zstd is smaller than the default snappy at similar read speed, and row groups of 120K rows
+# keep scans of the written files parallel
+PARQUET_COPY_OPTIONS = "FORMAT 'parquet', COMPRESSION 'zstd', ROW_GROUP_SIZE 122880"
+# Tables and views in the db, read from the catalog functions that information_schema wraps
+DB_OBJECTS_SQL = (
+    "select table_name as name from duckdb_tables() where schema_name='main' "
+    "union all select view_name from duckdb_views() where schema_name='main' and not internal"
+)
 # column names
 PID_HASH = "pid_hash"
@@ -5,8 +5,8 @@ INSERT INTO mitre_labels (
     entity_type
 )
 VALUES (
-    '{{ entity }}',
-    '{{ analytic_id }}',
-    to_timestamp({{ time }}),
-    '{{ entity_type }}'
+    ?,
+    ?,
+    to_timestamp(?),
+    ?
 )
@@ -1,22 +1,46 @@
 import logging
 import os
+import uuid
 from dataclasses import dataclass
-from datetime import datetime
-from typing import Optional
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import List, Optional, Tuple, Union
 
 import duckdb
-from duckdb import DuckDBPyConnection
+import pyarrow as pa
+from duckdb import DuckDBPyConnection, DuckDBPyRelation
 from jinja2 import Environment, FileSystemLoader
 from pandas import DataFrame
 
 from .constants import (
     CAR_ANALYTICS_RESULTS_TABLE,
     CREATE_ANALYTICS_RESULTS_TEMPLATE,
+    DB_OBJECTS_SQL,
     INSERT_ANALYTICS_RESULTS_TEMPLATE,
+    PARQUET_COPY_OPTIONS,
     PID_HASH,
     TEMPLATE_DIR,
 )
 
+# prefix of the name the arrow batch is registered under during a bulk insert
+ANALYTICS_RESULTS_BATCH_VIEW = "analytics_results_batch"
+
+# The packaged templates don't change while running, so never re-stat them
+_TEMPLATE_ENVIRONMENT = Environment(
+    loader=FileSystemLoader(os.path.join(os.path.dirname(__file__), TEMPLATE_DIR)),
+    auto_reload=False,
+    cache_size=-1,
+)
+
+
+@lru_cache(maxsize=None)
+def render_template(name: str) -> str:
+    """
+    Render a packaged sql template. None of them take arguments, so each is rendered once
+    per process rather than once per WintapDuckDB.
+    """
+    return _TEMPLATE_ENVIRONMENT.get_template(name).render()
+
 
 @dataclass
 class WintapDuckDBOptions:
@@ -35,9 +59,9 @@ class WintapDuckDB:
         self._connection = options.connection
         self._dataset_path = options.dataset_path
         self._load_analytics = options.load_analytics
-        cwd = os.path.dirname(__file__)
-        self._jinja_environment = Environment(
-            loader=FileSystemLoader(os.path.join(cwd, TEMPLATE_DIR))
+        # The insert only takes bound parameters, so it is reused as is
+        self._insert_analytics_results_sql = render_template(
+            INSERT_ANALYTICS_RESULTS_TEMPLATE
         )
         self._setup_tables()
 
@@ -48,26 +72,30 @@ class WintapDuckDB:
                 return
         # Because we are generating analytics, we should drop any existing views
         # of our data, else we will run into errors
-        self.query(f"DROP VIEW IF EXISTS {CAR_ANALYTICS_RESULTS_TABLE}")
-        self.query(
-            self._jinja_environment.get_template(
-                CREATE_ANALYTICS_RESULTS_TEMPLATE
-            ).render()
-        )
+        self.execute(f"DROP VIEW IF EXISTS {CAR_ANALYTICS_RESULTS_TABLE}")
+        self.execute(render_template(CREATE_ANALYTICS_RESULTS_TEMPLATE))
         # shim in for sigma
-        self.query(f"DROP VIEW IF EXISTS sigma_labels")
-        self.query(
-            self._jinja_environment.get_template("create_sigma_results.sql").render()
-        )
+        self.execute(f"DROP VIEW IF EXISTS sigma_labels")
+        self.execute(render_template("create_sigma_results.sql"))
 
     def _is_table_or_view(self, table_name: str):
-        try:
-            self.query(f"describe {table_name}")
+        # Check the catalog rather than describe, which binds the object and for
+        # parquet backed views has to read file metadata.
+        # Not cached: the connection is shared with the view setup in rawutil and the
+        # transformers, which create and drop objects outside this class, and this is
+        # only called once per instance from _setup_tables.
+        exists = (
+            self._connection.execute(
+                "select 1 from information_schema.tables where table_schema='main' and lower(table_name) = lower(?)",
+                [table_name],
+            ).fetchone()
+            is not None
+        )
+        if exists:
             logging.debug(f"table or view ({table_name}) already exists")
-        except duckdb.CatalogException as err:
+        else:
             logging.debug(f"table or view ({table_name}) does not exist")
-            return False
-        return True
+        return exists
 
     def get_tables(self) -> list:
         """
@@ -75,17 +103,53 @@ class WintapDuckDB:
         exclude should be a list of strings. If the strings appear in the object names, they'll be dropped from the result.
         """
         db_objects = self._connection.execute(
-            "select table_name, table_type from information_schema.tables where table_schema='main' order by all"
+            f"{DB_OBJECTS_SQL} order by all"
         ).fetchall()
 
-        return [t for t, _ in db_objects]
+        return [t for t, in db_objects]
 
-    def query(self, query_string: str) -> DataFrame:
+    def query(
+        self, query_string: str, output: str = "df"
+    ) -> Union[DataFrame, pa.Table, DuckDBPyRelation]:
         """
         Given a string representing a DuckDB query, execute it
-        against the configured db connection
+        against the configured db connection.
+        output selects the result type: "df" (pandas, default), "arrow" or "relation".
+        A relation isn't run until it is consumed, so further SQL can be chained
+        onto it without materializing the intermediate result.
         """
-        return self._connection.execute(query_string).df()
+        if output == "relation":
+            return self._connection.sql(query_string)
+        if output == "arrow":
+            return self.query_arrow(query_string)
+        if output == "df":
+            return self._connection.execute(query_string).df()
+        raise ValueError(f"Unsupported query output: {output}")
+
+    def query_arrow(self, query_string: str) -> pa.Table:
+        """
+        Given a string representing a DuckDB query, execute it
+        against the configured db connection and return the result as an arrow table
+        """
+        return self._connection.execute(query_string).fetch_arrow_table()
+
+    def execute(self, query_string: str) -> None:
+        """
+        Execute a statement whose result isn't needed (DDL/DML) against the
+        configured db connection, without converting the result to a DataFrame
+        """
+        self._connection.execute(query_string)
+
+    def execute_in_cursor(self, query_string: str) -> None:
+        """
+        Execute a statement on a new cursor of the configured db connection.
+        Cursors can be used from separate threads, so DuckDB runs these concurrently.
+        """
+        cursor = self._connection.cursor()
+        try:
+            cursor.execute(query_string)
+        finally:
+            cursor.close()
 
     def register_filesystem(self, fs: str) -> None:
         return self._connection.register_filesystem(filesystem=fs)
@@ -116,13 +180,9 @@ class WintapDuckDB:
             else:
                 pathspec = f"{path}/rolling/{table}/dayPK={partition_key}"
                 filename = f"{table}-{partition_key}.parquet"
-            if not os.path.exists(pathspec):
-                os.makedirs(pathspec)
-                logging.debug("folder '{}' created ".format(pathspec))
-            else:
-                logging.debug("folder {} already exists".format(pathspec))
+            os.makedirs(pathspec, exist_ok=True)
             # TODO Add test for file existence
-            sql = f"COPY {table} TO '{pathspec}/{filename}' (FORMAT 'parquet')"
+            sql = f"COPY {table} TO '{pathspec}/{filename}' ({PARQUET_COPY_OPTIONS})"
             logging.debug(f"generated copy sql: {sql}")
             self._connection.execute(sql)
         except duckdb.IOException as e:
@@ -134,20 +194,52 @@ class WintapDuckDB:
         analytic_id: str,
         entity_id: str,
         entity_type: str = PID_HASH,
-        event_time: datetime = datetime.now(),
+        event_time: Optional[datetime] = None,
     ) -> None:
-        sql = self._jinja_environment.get_template(
-            INSERT_ANALYTICS_RESULTS_TEMPLATE
-        ).render(
+        # evaluated per call, a datetime.now() default would be frozen at import time
+        event_time = event_time or datetime.now(timezone.utc)
+        params = [
             # for now, we will simply support pid_hash as entity ids
-            entity=entity_id,
-            analytic_id=analytic_id,
-            time=int(event_time.strftime("%s")),
+            entity_id,
+            analytic_id,
+            int(event_time.timestamp()),
             # for now, we will simply support pid_hash as entity types
-            entity_type=entity_type,
+            entity_type,
+        ]
+        logging.debug(
+            f"generated insert analtyic: {self._insert_analytics_results_sql} {params}"
         )
-        logging.debug(f"generated insert analtyic: {sql}")
-        self._connection.execute(sql)
+        self._connection.execute(self._insert_analytics_results_sql, params)
+
+    def insert_analytics_results_bulk(
+        self, rows: List[Tuple[str, str, datetime, str]]
+    ) -> None:
+        """
+        Insert many analytic results at once, rows are (entity, analytic_id, time, entity_type).
+        The rows are handed to DuckDB as a single arrow table instead of rendering and
+        parsing an INSERT per result.
+        """
+        if not rows:
+            return
+        entity, analytic_id, time, entity_type = zip(*rows)
+        batch = pa.table(
+            {
+                "entity": pa.array(entity, pa.string()),
+                "analytic_id": pa.array(analytic_id, pa.string()),
+                "time": pa.array(time, pa.timestamp("us")),
+                "entity_type": pa.array(entity_type, pa.string()),
+            }
+        )
+        # Registered names are shared by the whole connection, a unique one per call keeps
+        # concurrent inserts from replacing each other's batch.
+        batch_view = f"{ANALYTICS_RESULTS_BATCH_VIEW}_{uuid.uuid4().hex}"
+        self._connection.register(batch_view, batch)
+        try:
+            sql = f"INSERT INTO {CAR_ANALYTICS_RESULTS_TABLE} SELECT entity, analytic_id, time, entity_type FROM {batch_view}"
+            logging.debug(f"generated bulk insert analytics: {sql} ({len(rows)} rows)")
+            self._connection.execute(sql)
+        finally:
+            self._connection.unregister(batch_view)
 
     def clear_table(self, table: str) -> None:
         """clear contents of a table in the connection. Mainly used after writing out table to file."""
@@ -3,16 +3,32 @@ import os
 import re
 import tempfile
 import time
-from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from glob import glob
+from functools import lru_cache, partial
+from glob import glob, iglob
 from importlib.resources import files as resource_files
-from typing import List, Optional
+from typing import List, Optional, Tuple
 
 import duckdb
 import pyarrow.parquet as pq
 from duckdb import CatalogException
-from pyarrow.lib import ArrowInvalid
+
+from wintappy.database.constants import DB_OBJECTS_SQL, PARQUET_COPY_OPTIONS
+
+# First word of a line that starts a new statement in a sql script
+STATEMENT_START_RE = re.compile(
+    r"(create|alter|update|insert|delete|select)(?:\s|$)", re.IGNORECASE
+)
+# Maximum tables/views written to parquet concurrently
+WRITE_WORKERS = min(8, os.cpu_count() or 1)
+# Row counts come from the footers, so no column data is read
+PARQUET_ROW_COUNTS_SQL = "SELECT file_name, num_rows FROM parquet_file_metadata(?)"
+# Row count markers for files that couldn't be checked
+INVALID_PARQUET = -1
+UNREADABLE_PARQUET = -2
+# Maximum files checked concurrently when they have to be checked one at a time
+PARQUET_CHECK_WORKERS = 32
 
 
 @dataclass
@@ -38,10 +54,17 @@ def init_db(dataset=None, agg_level="rolling", database=":memory:", lookups=""):
     con = duckdb.connect(database=database)
     # set caching dir to a temp directory location
     con.execute(f"SET temp_directory = '{tempfile.mkdtemp()}'")
+    # Keep parquet footers in memory so the views over them don't re-read every file's
+    # metadata on each query.
+    con.execute("SET parquet_metadata_cache = true")
     # TODO Make threads configurable.
     # 8 is for big malware run
     #    con.execute(f"set threads = 8")
-    logging.debug(f"Duckdb info: {con.sql('CALL pragma_database_size()').fetchall()}")
+    # Runs a query, so only when it'll be logged
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug(
+            "Duckdb info: %s", con.sql("CALL pragma_database_size()").fetchall()
+        )
     # TODO fix reference to SQL scripts
     run_sql_no_args(con, resource_files("wintappy.datautils").joinpath("initdb.sql"))
     if not dataset == None:
@@ -60,6 +83,8 @@ def get_glob_paths_for_dataset(dataset, subdir="raw_sensor", include=None, looku
 
     Single file at the top level:
     {dataset}/{eventType}.parquet
+
+    Raises if an event type has more than one glob, event types without any files are skipped.
     """
     dataset_path = os.path.join(dataset, subdir)
     event_types = [
@@ -72,74 +97,74 @@ def get_glob_paths_for_dataset(dataset, subdir="raw_sensor", include=None, looku
         for name in files:
             if name.endswith(".parquet") or name.endswith(".csv"):
                 event_types.append(os.path.join(path, name))
-    globs = defaultdict(set)
+    globs = {}
+    pathspecs = {}
     for cur_event in event_types:
-        event_type = cur_event.split(os.sep)[-1]
+        event_type = os.path.basename(cur_event)
         if os.path.isdir(cur_event):
-            for dirpath, dirnames, filenames in os.walk(cur_event):
-                if not dirnames:
-                    if dirpath == cur_event:
-                        # No dir globs needed
-                        globs[event_type].add(f"{cur_event}{os.sep}*.parquet")
-                    else:
-                        # Remove the prefix, including event_type. Convert that to a glob.
-                        subdir = dirpath.replace(cur_event, "")
-                        glob = os.sep.join(["*"] * subdir.count(os.path.sep))
-                        globs[event_type].add(
-                            os.path.join(cur_event, glob, "*.parquet")
-                        )
-                        logging.debug(
-                            f"{event_type} {subdir} {glob} has 0 subdirectories and {len(filenames)} files"
-                        )
-        else:
+            # One wildcard per directory level between the event dir and the leaf dirs.
+            # No dir globs needed when the files are directly in the event dir.
+            pathspec_set = {
+                os.sep.join((cur_event, *(["*"] * depth), "*.parquet"))
+                for depth in leaf_depths(cur_event)
+            }
+        elif event_type.lower().endswith(("parquet", "csv")):
             # Treat as a simple, single file.
-            if event_type.lower().endswith("parquet"):
-                event = re.split(r"\.", event_type)[0]
-                logging.info(f"Found {event} file: {event_type}")
-                globs[event].add(cur_event)
-            elif event_type.lower().endswith("csv"):
-                event = re.split(r"\.", event_type)[0]
-                logging.info(f"Found {event} file: {event_type}")
-                globs[event].add(cur_event)
-    return validate_globs(globs)
-
-
-def validate_globs(raw_data):
-    """
-    raw_data is a map of event_type -> list of globs.
-    Confirm that:
-    * There is only 1 glob per event_type. A poorly formed dataset dir structure could result in multiples.
-    * That there are actually files in the path. It's not uncommon for collection of specific feature type to by inconsistent over time.
-    * For each file, confirm that it has data. Wintap does produce empty parquet files and that confuses duckdb and some other tools.
-        * If an empty file is found, delete it
-        * When complete, if all files were empty, then remove the event_type/glob entry.
-    """
-    globs = {}
-    for event_type, pathspec_set in raw_data.items():
-        # Normally, we'll only have one pathspec.
+            # Event name is everything before the first dot
+            event = event_type.partition(".")[0]
+            logging.info("Found %s file: %s", event, event_type)
+            event_type = event
+            pathspec_set = {cur_event}
+        else:
+            continue
+        if event_type in pathspecs:
+            pathspec_set.add(pathspecs[event_type])
+        # Normally, we'll only have one pathspec. A poorly formed dataset dir structure could result in multiples.
         if len(pathspec_set) > 1:
             raise Exception(f"Too many leaf dirs!: {pathspec_set}")
+        if not pathspec_set:
+            continue
+        pathspec = pathspecs[event_type] = next(iter(pathspec_set))
+        # It's not uncommon for collection of specific feature type to by inconsistent over time.
+        if next(iglob(pathspec), None) is None:
+            logging.info("Not found: %s  Skipping", pathspec)
         else:
-            pathspec = next(iter(pathspec_set))
-            num_files = len(glob(pathspec))
-            if num_files == 0:
-                logging.info(f"Not found: {pathspec}  Skipping")
-            else:
-                logging.info(f"Found {num_files} parquet files in {pathspec}")
-                #                for file in glob(pathspec):
-                #                    table=pq.read_table(file)
-                #                    if table.num_rows==0:
-                #                        logging.info(f'{file} is empty, deleting.')
-                #                        os.remove(file)
-                #                        num_files-=1
-                if num_files == 0:
-                    logging.info(f"Skipping empty glob: {pathspec}")
-                else:
-                    globs[event_type] = pathspec
+            # Only list all the files when the count will be logged.
+            if logging.getLogger().isEnabledFor(logging.INFO):
+                num_files = sum(1 for _ in iglob(pathspec))
+                logging.info("Found %s parquet files in %s", num_files, pathspec)
+            globs[event_type] = pathspec
     return globs
 
 
-def get_globs_for(dataset, daypk):
+def leaf_depths(path, depth=0):
+    """
+    Return the set of depths, relative to path, of the directories below it that have no
+    subdirectories. Symlinked dirs count as subdirectories but aren't followed, like os.walk.
+    Empty hive partition dirs (e.g. a dayPK= created before any data landed) are skipped.
+    Stops walking once more than one depth is found, as the layout is already invalid.
+    """
+    try:
+        with os.scandir(path) as it:
+            entries = list(it)
+    except OSError:
+        return set()
+    subdirs = [entry for entry in entries if entry.is_dir()]
+    if not subdirs:
+        if not entries and depth > 0 and "=" in os.path.basename(path):
+            return set()
+        return {depth}
+    depths = set()
+    for entry in subdirs:
+        if entry.is_symlink():
+            continue
+        depths |= leaf_depths(entry.path, depth + 1)
+        if len(depths) > 1:
+            break
+    return depths
+
+
+def get_globs_for(dataset, daypk, con=None):
     """
     This function is intended to reduce the raw_sensor input to a single day of activity for processing.
     First, get the full glob paths for raw_sensor.  Then, splice in the dayPK specification.
@@ -147,39 +172,82 @@ def get_globs_for(dataset, daypk):
     """
     globs_all = get_glob_paths_for_dataset(dataset)
     globs = {}
+    # Only parquet footers are read to check for empty files, any connection will do.
+    check_con = con or duckdb.connect()
     for event_type, pathspec in globs_all.items():
         # Add in the daypk filter
         pathspec = pathspec.replace(
             f"{os.sep}*{os.sep}", f"{os.sep}dayPK={daypk}{os.sep}", 1
         )
-        num_files = len(glob(pathspec))
-        if num_files == 0:
-            logging.info(f"Not found: {pathspec}  Skipping")
+        files = glob(pathspec)
+        if not files:
+            logging.info("Not found: %s  Skipping", pathspec)
         else:
-            logging.info(f"Found {num_files} parquet files in {pathspec}")
+            logging.info("Found %s parquet files in %s", len(files), pathspec)
             # Check for empty files. These confuse duckdb and lead to schema errors.
-            for file in glob(pathspec):
-                try:
-                    table = pq.read_table(file)
-                    if table.num_rows == 0:
-                        logging.info(f"{file} is empty, deleting.")
-                        os.remove(file)
-                except ArrowInvalid:
+            num_kept = 0
+            for file, num_rows in parquet_row_counts(
+                check_con, pathspec, files
+            ).items():
+                if num_rows > 0:
+                    num_kept += 1
+                elif num_rows == 0:
+                    logging.info("%s is empty, deleting.", file)
+                    os.remove(file)
+                elif num_rows == INVALID_PARQUET:
                     # Move invalid files out of the way
                     # Move to dataset/invalid/path
                     logging.error(f"Invalid parquet: {file}")
                     os.rename(file, f"{file}.invalid")
-                except OSError as e:
-                    logging.error(f"OSError on {file}", e)
+                elif num_rows == UNREADABLE_PARQUET:
                     os.rename(file, f"{file}.oserror_invalid")
             # Sometimes, all the files have been removed, skip the pathspec in those cases
-            if len(glob(pathspec)) > 0:
+            if num_kept > 0:
                 globs[event_type] = pathspec
             else:
-                logging.info(f"Skipping empty path: {pathspec}")
+                logging.info("Skipping empty path: %s", pathspec)
+    if con is None:
+        check_con.close()
     return globs
 
 
+def parquet_row_counts(con, pathspec, files=None):
+    """
+    Map each file matching pathspec to its row count, read from the parquet footers only.
+    files is the already globbed pathspec, if the caller has it.
+    Files that aren't valid parquet map to INVALID_PARQUET, files that can't be read
+    map to UNREADABLE_PARQUET.
+    """
+    try:
+        return dict(con.execute(PARQUET_ROW_COUNTS_SQL, [pathspec]).fetchall())
+    except duckdb.Error:
+        # At least one bad file fails the whole scan, check them one at a time to find it.
+        pass
+    if files is None:
+        files = glob(pathspec)
+    # The footer reads are I/O bound, overlap them on separate cursors.
+    row_counts = {}
+    with ThreadPoolExecutor(
+        max_workers=max(1, min(PARQUET_CHECK_WORKERS, len(files)))
+    ) as executor:
+        for file_counts in executor.map(partial(file_row_counts, con), files):
+            row_counts.update(file_counts)
+    return row_counts
+
+
+def file_row_counts(con, file):
+    cursor = con.cursor()
+    try:
+        return cursor.execute(PARQUET_ROW_COUNTS_SQL, [file]).fetchall()
+    except duckdb.IOException as e:
+        logging.error(f"OSError on {file}: {e}")
+        return [(file, UNREADABLE_PARQUET)]
+    except duckdb.Error:
+        return [(file, INVALID_PARQUET)]
+    finally:
+        cursor.close()
+
+
 def loadSqlStatements(file) -> List[SqlStmt]:
     """
     Read sql script. Parse into individual statements.
@@ -197,55 +265,63 @@ def loadSqlStatements(file) -> List[SqlStmt]:
 
     Template - applies only to CREATEs. The subdirectory within "./schema" that has the template parquet file.
     """
-    file = open(file, "r")
-    lines = file.readlines()
+    # The scripts are packaged and run over and over (e.g. once per day), only parse them once
+    path = str(file)
+    return list(_load_sql_statements(path, os.path.getmtime(path)))
 
+
+@lru_cache(maxsize=None)
+def _load_sql_statements(path: str, mtime: float) -> Tuple[SqlStmt, ...]:
+    with open(path, "r") as file:
+        return _parse_sql_statements(file)
+
+
+def _parse_sql_statements(lines) -> Tuple[SqlStmt, ...]:
     statements = []
     linenumber = 0
     inStmt = False
     for linenumber, line in enumerate(lines):
-        keyword = line.split(" ")[0].strip().lower()
-        if not inStmt and keyword in [
-            "create",
-            "alter",
-            "update",
-            "insert",
-            "delete",
-            "select",
-        ]:
+        match = None if inStmt else STATEMENT_START_RE.match(line)
+        if match:
             # start of a new statement
             # For tables and views, use the object name
-            if keyword == "create":
+            if match.group(1).lower() == "create":
                 name = line.strip().split()[-1]
             else:
                 # Add line number to be sure its unique as there can be multiple of these per table
                 name = f"{line.strip()}-{linenumber}"
             curStatement = SqlStmt(
                 name=name,
-                sql=line,
+                sql="",
                 required=False,
                 template=None,
             )
+            # Collect the lines and join them once the statement ends
+            sql_lines = [line]
             inStmt = True
-        elif line.lower().startswith("--# name:"):
+            continue
+        # The --# directives are at the start of the line, only lowercase that much
+        directive = line[:16].lower()
+        if directive.startswith("--# name:"):
             # Override default name with provided one.
             curStatement.name = line.split(":")[1].strip()
-        elif line.lower().startswith("--# required"):
+        elif directive.startswith("--# required"):
             # This object is required to exist, so if execution fails, an empty object will be created with a matching schema.
             curStatement.required = True
-        elif line.lower().startswith("--# template:"):
+        elif directive.startswith("--# template:"):
             # Template identifies where the corresponding parquet template is that will be used for creating empty objects.
             curStatement.template = line.split(":")[1].strip()
         else:
             if line.strip() == ";":
                 # We done. Save the statement. Don't save the semi-colon.
+                curStatement.sql = "".join(sql_lines)
                 statements.append(curStatement)
                 inStmt = False
                 logging.debug(curStatement.sql)
             else:
                 if inStmt:
-                    curStatement.sql += line
-    return statements
+                    sql_lines.append(line)
+    return tuple(statements)
 
 
 def generate_view_sql(event_map, start=None, end=None):
@@ -254,15 +330,19 @@ def generate_view_sql(event_map, start=None, end=None):
     """
     # View Template
     stmts = []
+    daypk_filter = get_daypk_filter(start, end)
     for event_type, pathspec in event_map.items():
         if "raw_" in event_type and "/raw_sensor/" in pathspec:
             # Raw files *may* have differing schemas, so enable union'ing of all schemas.
             # FIX in Wintap(?): Found that exact dups are in the raw tables, so remove them here using the GROUP BY ALL.
             # Only implement duplicate fix on 'raw_sensor' path. RAW tables in 'rolling' are already fixed.
-            view_sql = get_raw_view(event_type, pathspec)
+            view_sql = get_raw_view(event_type, pathspec, daypk_filter)
         elif pathspec.endswith(".csv"):
+            # CSV lookups are small and joined against repeatedly, load them once rather than
+            # re-parsing the file on every query of a view. The table is a snapshot, changes
+            # to the CSV show up the next time the views are created.
             view_sql = f"""
-            create or replace view {event_type} as
+            create or replace table {event_type} as
             select * from read_csv('{pathspec}', AUTO_DETECT=TRUE)
             """
         else:
@@ -270,20 +350,38 @@ def generate_view_sql(event_map, start=None, end=None):
             create or replace view {event_type} as
             select * from parquet_scan('{pathspec}',hive_partitioning=1)
             """
-            # Apply start/end filtering for rolling tables only.
+            # Apply start/end filtering for rolling tables, raw_sensor views filter in get_raw_view.
             if "/rolling/" in pathspec:
-                if start and end:
-                    view_sql += f"where dayPK between {start} and {end}"
-                if start is not None and end is None:
-                    view_sql += f"where dayPK = {start}"
+                view_sql += daypk_filter
         if view_sql:
             stmts.append(view_sql)
-            logging.debug(f"View for {event_type} using {pathspec}")
+            logging.debug("View for %s using %s", event_type, pathspec)
             logging.debug(view_sql)
     return stmts
 
 
-def get_raw_view(event_type: str, pathspec):
+def get_daypk_filter(start=None, end=None) -> str:
+    """
+    Where clause limiting hive partitioned data to the start/end dayPKs, empty when no start
+    is given. The dayPKs are cast to int so they can't inject SQL.
+    """
+    if not start:
+        return ""
+    if end:
+        return f"where dayPK between {int(start)} and {int(end)}"
+    return f"where dayPK = {int(start)}"
+
+
+@lru_cache(maxsize=512)
+def parquet_schema_names(file: str, mtime: float) -> Tuple[str, ...]:
+    """
+    Column names of a parquet file, cached by path and mtime so recreating views doesn't
+    re-parse the footer.
+    """
+    return tuple(pq.read_schema(file).names)
+
+
+def get_raw_view(event_type: str, pathspec, daypk_filter: str = ""):
     """
     The introduction of agentid causes a ripple effect thru all ETL SQL.
     For as long as is reasonable, auto-detect incoming parquet and add a null agentid when missing.
@@ -292,16 +390,18 @@ def get_raw_view(event_type: str, pathspec):
     """
 
     # Get the schema from the first parquet file
-    schema = pq.read_schema(glob(pathspec)[0])
-    from_clause = f"from parquet_scan('{pathspec}',hive_partitioning=1,union_by_name=true) group by all"
+    first_file = next(iglob(pathspec))
+    schema_names = parquet_schema_names(first_file, os.path.getmtime(first_file))
+    # Filter before the dedup so only the partitions in range are scanned.
+    from_clause = f"from parquet_scan('{pathspec}',hive_partitioning=1,union_by_name=true) {daypk_filter} group by all"
     # Default to all columns
     col_list = "*"
     # Default to agentid existing. Note that the exclude is buried in the "col_list" definition as there can only be 1 exclude list.
     agent_id_col = "agentid"
-    if not "AgentId" in schema.names:
+    if not "AgentId" in schema_names:
         agent_id_col = "cast(null as varchar) agentid"
 
-    if "ConnId" in schema.names:
+    if "ConnId" in schema_names:
         # Wintap used in ACME4 has a bug in CONNID creation: its not sorting the src/dest fields. Fix it here.
         # Column list that generates a new connid value
         col_list = "list_sort([int_to_ip(cast(localipaddr as bigint)), cast(localport AS varchar),int_to_ip(cast(remoteipaddr as bigint)),CAST(remoteport AS varchar),protocol]) ConnId, * exclude (connid,agentid)"
@@ -316,20 +416,50 @@ def get_raw_view(event_type: str, pathspec):
 
 def create_views(con, event_map, start=None, end=None):
     stmts = generate_view_sql(event_map, start, end)
+    if not stmts:
+        return
+    drop_lookup_views(con, event_map)
+    try:
+        # Views are metadata only, create them all in one round trip.
+        con.execute(";\n".join(stmts) + ";")
+        return
+    except (duckdb.IOException, duckdb.ParserException):
+        # Redo them one at a time to report the view that failed.
+        logging.debug(
+            "Creating views in one script failed, creating them one at a time"
+        )
     for sql in stmts:
-        cursor = con.cursor()
         try:
-            cursor.execute(sql)
-        except duckdb.duckdb.IOException as e:
-            logging.error(f"SQL Failed: {sql}", e)
+            con.execute(sql)
+        except duckdb.IOException as e:
+            logging.error(f"SQL Failed: {sql}\n{e}")
             logging.error("If the error is too many files open, try this on OSX:")
             logging.error("ulimit -Sn 524288; ulimit -Hn 10485760")
             raise e
-        except duckdb.duckdb.ParserException as e:
-            logging.error(f"SQL Failed: {sql}", e)
+        except duckdb.ParserException as e:
+            logging.error(f"SQL Failed: {sql}\n{e}")
             raise e
-        finally:
-            cursor.close()
+
+
+def drop_lookup_views(con, event_map):
+    """
+    Databases created before CSV lookups were tables have a view of the same name, which
+    create or replace table can't replace. Drop those views, leaving lookups that are
+    already tables alone.
+    """
+    lookups = [
+        event_type.lower()
+        for event_type, pathspec in event_map.items()
+        if pathspec.endswith(".csv")
+    ]
+    if not lookups:
+        return
+    for (view_name,) in con.execute(
+        "select view_name from duckdb_views() where schema_name='main' and not internal and list_contains(?, lower(view_name))",
+        [lookups],
+    ).fetchall():
+        logging.info("Replacing lookup view %s with a table", view_name)
+        con.execute(f'drop view "{view_name}"')
 
 
 def validate_raw_views(con, raw_data, start=None, end=None):
@@ -343,12 +473,14 @@ def validate_raw_views(con, raw_data, start=None, end=None):
     if "raw_process" in raw_data.keys():
         # Validate existence of raw_process_stop fields. Shortcut by just checking for 1 for now.
         col_sql = """
-            select table_catalog, table_name, column_name
-            from information_schema.columns
-            where table_name ilike 'raw_process'
-            and lower(column_name)=lower('CPUCycleCount')
+            select exists (
+                select 1
+                from information_schema.columns
+                where table_name ilike 'raw_process'
+                and lower(column_name)=lower('CPUCycleCount')
+            )
             """
-        if con.sql(col_sql).count("*").fetchone()[0] == 0:
+        if not con.execute(col_sql).fetchone()[0]:
             # It's missing, create the empty file from the template
             src_file = resource_files("wintappy.schema.raw_sensor").joinpath(
                 "raw_processstop.parquet"
@@ -410,12 +542,12 @@ def run_sql_no_args(con, sqlfile):
     """
     etl_sql = loadSqlStatements(sqlfile)
     for sqlstmt in etl_sql:
-        logging.info(f"Processing: {sqlstmt.name}")
+        logging.info("Processing: %s", sqlstmt.name)
         try:
             con.execute(sqlstmt.sql)
         except CatalogException as e:
-            logging.info(f"Missing dependent table/view for {sqlstmt.name}")
-            logging.debug(f"Error: {e}\nSQL: {sqlstmt.sql}")
+            logging.info("Missing dependent table/view for %s", sqlstmt.name)
+            logging.debug("Error: %s\nSQL: %s", e, sqlstmt.sql)
             if sqlstmt.required:
                 logging.info(f"Creating empty object from {sqlstmt.template}")
                 create_empty_table(con, sqlstmt)
@@ -432,15 +564,18 @@ def get_db_objects(con, exclude=None):
     Get all tables/views defined in the db.
     exclude should be a list of strings. If the strings appear in the object names, they'll be dropped from the result.
     """
-    db_objects = con.execute(
-        "select table_name, table_type from information_schema.tables where table_schema='main' order by all"
-    ).fetchall()
-    if exclude != None:
-        # Find matches NOT including any of the words
-        tables = [t for t, x in db_objects if not any(e in t for e in exclude)]
-        logging.debug(f"Not Matches: {tables}")
+    if exclude:
+        # Filter in DuckDB: keep names NOT including any of the words
+        tables = [
+            t
+            for t, in con.execute(
+                f"select name from ({DB_OBJECTS_SQL}) where not regexp_matches(name, ?) order by all",
+                ["|".join(re.escape(e) for e in exclude)],
+            ).fetchall()
+        ]
+        logging.debug("Not Matches: %s", tables)
     else:
-        tables = [t for t, x in db_objects]
+        tables = [t for t, in con.execute(f"{DB_OBJECTS_SQL} order by all").fetchall()]
     return tables
 
 
@@ -456,31 +591,89 @@ def check_column(con, table_name, column_name):
     return con.sql(col_sql).count("*").fetchone()[0] == 1
 
 
-def write_parquet(con, datasetpath, db_objects, daypk=None, agg_level="stdview"):
+def write_parquet(
+    con, datasetpath, db_objects, daypk=None, agg_level="stdview", partition_by=None
+):
     """
     Write tables/views from duckdb instance to parquet.
     If daypk is provided, write to corresponding path in rolling.
+    If partition_by is provided (e.g. "dayPK"), write every partition to rolling in one pass,
+    letting DuckDB build the hive layout.
     Otherwise, write to agg_level.
+    Existing parquet files in the rolling partitions being written are removed first, so
+    re-running a day, or switching between daypk and partition_by, replaces its rows.
     """
+    object_names = []
     for object_name in db_objects:
         if object_name == "raw_memorymap":
             logging.warn("Skipping raw_memorymap because its causing a OOM failure")
             continue
-        logging.info(f"Writing {object_name}")
-        try:
-            if daypk == None:
-                pathspec = f"{datasetpath}{os.sep}{agg_level}"
-                filename = f"{object_name}.parquet"
-            else:
-                pathspec = f"{datasetpath}{os.sep}rolling{os.sep}{object_name}{os.sep}dayPK={daypk}"
-                filename = f"{object_name}-{daypk}.parquet"
-            if not os.path.exists(pathspec):
-                os.makedirs(pathspec)
-                logging.debug(f"created folder: {pathspec} ")
-            else:
-                logging.debug(f"folder already exists: {pathspec}")
-            # TODO Add test for file existence
-            sql = f"COPY {object_name} TO '{pathspec}{os.sep}{filename}' (FORMAT 'parquet')"
-            con.execute(sql)
-        except duckdb.IOException as e:
-            logging.exception(f"Failed to write: {object_name}")
+        object_names.append(object_name)
+    if not object_names:
+        return
+    # Each COPY runs on its own cursor so the tables are written concurrently.
+    with ThreadPoolExecutor(
+        max_workers=min(WRITE_WORKERS, len(object_names))
+    ) as executor:
+        futures = [
+            executor.submit(
+                write_object,
+                con,
+                datasetpath,
+                object_name,
+                daypk,
+                agg_level,
+                partition_by,
+            )
+            for object_name in object_names
+        ]
+    # Re-raise anything other than the logged IOExceptions, as when writing serially.
+    for future in futures:
+        future.result()
+
+
+def clear_partition(pathspec):
+    """
+    Remove the parquet files in a rolling partition dir before it is rewritten.
+    """
+    for path in glob(f"{pathspec}{os.sep}*.parquet"):
+        os.remove(path)
+
+
+def write_object(
+    con, datasetpath, object_name, daypk=None, agg_level="stdview", partition_by=None
+):
+    logging.info("Writing %s", object_name)
+    cursor = con.cursor()
+    try:
+        if partition_by:
+            pathspec = f"{datasetpath}{os.sep}rolling{os.sep}{object_name}"
+            os.makedirs(pathspec, exist_ok=True)
+            # OVERWRITE_OR_IGNORE leaves files from earlier writes next to the new ones.
+            for values in cursor.execute(
+                f"SELECT DISTINCT {partition_by} FROM {object_name}"
+            ).fetchall():
+                partition = os.sep.join(
+                    f"{column.strip()}={value}"
+                    for column, value in zip(partition_by.split(","), values)
+                )
+                clear_partition(f"{pathspec}{os.sep}{partition}")
+            # Partition columns are only kept in the dir names, as in the single day layout.
+            sql = f"COPY {object_name} TO '{pathspec}' ({PARQUET_COPY_OPTIONS}, PARTITION_BY ({partition_by}), OVERWRITE_OR_IGNORE true, FILENAME_PATTERN '{object_name}-{{i}}')"
+            cursor.execute(sql)
+            return
+        if daypk == None:
+            pathspec = f"{datasetpath}{os.sep}{agg_level}"
+            filename = f"{object_name}.parquet"
+        else:
+            pathspec = f"{datasetpath}{os.sep}rolling{os.sep}{object_name}{os.sep}dayPK={daypk}"
+            filename = f"{object_name}-{daypk}.parquet"
+            clear_partition(pathspec)
+        os.makedirs(pathspec, exist_ok=True)
+        # TODO Add test for file existence
+        sql = f"COPY {object_name} TO '{pathspec}{os.sep}{filename}' ({PARQUET_COPY_OPTIONS})"
+        cursor.execute(sql)
+    except duckdb.IOException as e:
+        logging.exception(f"Failed to write: {object_name}")
+    finally:
+        cursor.close()
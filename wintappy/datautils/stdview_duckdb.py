@@ -1,6 +1,9 @@
 import logging
 import os
+import re
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
+from fnmatch import fnmatch
 from glob import iglob
 from typing import NamedTuple
 
@@ -11,6 +14,66 @@ from jinja2 import Template
 
 from wintappy.datautils import rawutil as ru
 
+# Maximum tables sized concurrently, the directory listings are I/O bound
+SIZE_WORKERS = 16
+
+# Clauses in a view's sql that make its rows differ from the rows in its files
+VIEW_CHANGES_ROWS_RE = re.compile(r"\b(where|group\s+by)\b", re.IGNORECASE)
+
+# Jinja templates are compiled once here rather than on every call.
+EVENT_SUMMARY_TEMPLATE = Template(
+    """
+    CREATE OR replace VIEW event_summary_raw_v1
+    AS
+    {%- for esm in esms %}
+    SELECT
+        '{{esm.label}}' as Event,
+        upper({{esm.host_col}}) as Hostname,
+        agentid,
+        {{esm.ts_func}} bin_date,
+        {{esm.num_event_func}} NumRows
+    FROM {{esm.table}}
+    WHERE dayPK between {{min_daypk}} and {{max_daypk}}
+    GROUP BY ALL
+    {% if not loop.last %}UNION{% endif %}
+    {%- endfor %}
+    """
+)
+
+# Row counts and dayPK range per table, from parquet footers when the table's files are known.
+PARTITIONED_TABLE_METADATA_TEMPLATE = Template(
+    """
+    {%- for table in tables %}
+    {%- if table in parquet_globs %}
+    SELECT '{{table}}' as Table_Name, min(try_cast(regexp_extract(file_name, 'dayPK=(\\d+)', 1) as integer)) Min_DayPK, max(try_cast(regexp_extract(file_name, 'dayPK=(\\d+)', 1) as integer)) Max_DayPK, cast(sum(num_rows) as bigint) as Num_Rows
+    FROM parquet_file_metadata('{{parquet_globs[table]}}')
+    {%- else %}
+    SELECT '{{table}}' as Table_Name, min(daypk) Min_DayPK, max(daypk) Max_DayPK, count(*) as Num_Rows
+    FROM {{table}}
+    {%- endif %}
+    {% if not loop.last %}UNION ALL{% endif %}
+    {%- endfor %}
+    ORDER BY table_name
+    """
+)
+
+# Row counts per table, from parquet footers when the table's files are known.
+TABLE_METADATA_TEMPLATE = Template(
+    """
+    {%- for table in tables %}
+    {%- if table in parquet_globs %}
+    SELECT '{{table}}' as Table_Name, cast(sum(num_rows) as bigint) as Num_Rows
+    FROM parquet_file_metadata('{{parquet_globs[table]}}')
+    {%- else %}
+    SELECT '{{table}}' as Table_Name, count(*) as Num_Rows
+    FROM {{table}}
+    {%- endif %}
+    {% if not loop.last %}UNION ALL{% endif %}
+    {%- endfor %}
+    ORDER BY table_name
+    """
+)
+
 
 @dataclass
 class EventSummaryColumn:
@@ -90,34 +153,19 @@ def create_event_summary_view(con, min_daypk, max_daypk):
     Create a view for all known raw event types.
     To add a new type, define in the event_summary_metadata.
     """
-    esms = event_summary_metadata()
-    tablesDF = con.execute(
-        "select table_name from information_schema.tables where table_name like 'raw_%'"
-    ).df()
-    db_tables = tablesDF["table_name"].tolist()
-
-    tables = [esm for esm in esms if esm.table in db_tables]
+    esm_by_table = {esm.table: esm for esm in event_summary_metadata()}
+    db_tables = {
+        row[0]
+        for row in con.execute(
+            "select table_name from information_schema.tables where table_name like 'raw_%'"
+        ).fetchall()
+    }
+
+    tables = [esm for table, esm in esm_by_table.items() if table in db_tables]
     logging.debug(f"Found: {tables}")
-    logging.info(f"Missing: {set(db_tables) - set(esm.table for esm in esms)}")
+    logging.info(f"Missing: {db_tables - esm_by_table.keys()}")
 
-    template = """
-    CREATE OR replace VIEW event_summary_raw_v1
-    AS
-    {%- for esm in esms %}
-    SELECT
-        '{{esm.label}}' as Event,
-        upper({{esm.host_col}}) as Hostname,
-        agentid,
-        {{esm.ts_func}} bin_date,
-        {{esm.num_event_func}} NumRows
-    FROM {{esm.table}}
-    WHERE dayPK between {{min_daypk}} and {{max_daypk}}
-    GROUP BY ALL
-    {% if not loop.last %}UNION{% endif %}
-    {%- endfor %}
-    """
-
-    sql = Template(template).render(
+    sql = EVENT_SUMMARY_TEMPLATE.render(
         esms=tables, min_daypk=min_daypk, max_daypk=max_daypk
     )
     logging.debug(f"Generated summary view: {sql}")
@@ -149,34 +197,53 @@ def init_db(con, min_dayPK, max_dayPK, bucket_size=None):
     )
 
 
-def duckdb_table_metadata(con, include_paritioned_data=True):
+def footer_globs(con, globs, partitioned=True):
+    """
+    The parquet globs whose table can be summarized from the file footers alone. The view has
+    to be a plain scan of the files: a where clause (start/end dayPKs) or group by (raw
+    de-duplication) changes the rows. When partitioned, the files also have to be hive
+    partitioned by dayPK, as the dayPK range is read from their paths.
+    """
+    views = dict(
+        con.execute(
+            "select view_name, sql from duckdb_views() where schema_name='main' and not internal"
+        ).fetchall()
+    )
+    plain_globs = {}
+    for table, glob in (globs or {}).items():
+        if not glob.endswith(".parquet"):
+            continue
+        view_sql = views.get(table)
+        if view_sql is None or VIEW_CHANGES_ROWS_RE.search(view_sql):
+            continue
+        if partitioned:
+            first_file = next(iglob(glob), None)
+            if first_file is None or f"{os.sep}dayPK=" not in first_file:
+                continue
+        plain_globs[table] = glob
+    return plain_globs
+
+
+def duckdb_table_metadata(con, include_paritioned_data=True, globs=None):
+    """
+    Row counts (and dayPK range for partitioned data) per table.
+    When globs maps a table to its parquet files and the table is a plain view of them, the
+    counts are summed from the parquet footers rather than scanning the table.
+    """
     # Ignore objects ending in _v1 as they are likely complex view and can be expensive to count.
     in_clause = "IN" if include_paritioned_data else "NOT IN"
     tablesDF = con.execute(
         f"select table_name from information_schema.tables where table_name not like '%_v1' and table_name {in_clause} ( select table_name from information_schema.columns WHERE column_name = 'dayPK' ) order by all"
     ).df()
     tables = tablesDF["table_name"].tolist()
-    if include_paritioned_data:
-        template = """
-        {%- for table in tables %}
-        SELECT '{{table}}' as Table_Name, min(daypk) Min_DayPK, max(daypk) Max_DayPK, count(*) as Num_Rows
-        FROM {{table}}
-        {% if not loop.last %}UNION ALL{% endif %}
-        {%- endfor %}
-        ORDER BY table_name
-        """
-    else:
-        template = """
-        {%- for table in tables %}
-        SELECT '{{table}}' as Table_Name, count(*) as Num_Rows
-        FROM {{table}}
-        {% if not loop.last %}UNION ALL{% endif %}
-        {%- endfor %}
-        ORDER BY table_name
-        """
-
+    parquet_globs = footer_globs(con, globs, include_paritioned_data)
     if not tablesDF.empty:
-        sql = Template(template).render(tables=tables)
+        template = (
+            PARTITIONED_TABLE_METADATA_TEMPLATE
+            if include_paritioned_data
+            else TABLE_METADATA_TEMPLATE
+        )
+        sql = template.render(tables=tables, parquet_globs=parquet_globs)
         logging.debug(f"Generated sql: {sql}")
         return con.execute(sql).df()
     else:
@@ -189,45 +256,72 @@ def table_summary(
     """
     Get the list of tables defined in duckdb, then add sizes for the associated parquet files.
     """
-    tablesDF = duckdb_table_metadata(con, include_paritioned_data)
-    if not tablesDF.empty:
-        globs = ru.get_glob_paths_for_dataset(dataset, agg_level, lookups=lookups)
-        for event, glob in globs.items():
-            cur_size = cur_files = 0
-            for file in iglob(glob):
-                cur_size += os.path.getsize(file)
-                cur_files += 1
-            tablesDF.loc[tablesDF.Table_Name == event, "Size"] = format_size(cur_size)
-            tablesDF.loc[tablesDF.Table_Name == event, "Files"] = cur_files
+    globs = ru.get_glob_paths_for_dataset(dataset, agg_level, lookups=lookups)
+    tablesDF = duckdb_table_metadata(con, include_paritioned_data, globs)
+    if not tablesDF.empty and globs:
+        with ThreadPoolExecutor(max_workers=min(SIZE_WORKERS, len(globs))) as executor:
+            sizes = dict(zip(globs, executor.map(glob_size, globs.values())))
+        tablesDF["Size"] = tablesDF.Table_Name.map(
+            {event: format_size(size) for event, (size, _) in sizes.items()}
+        )
+        tablesDF["Files"] = tablesDF.Table_Name.map(
+            {event: files for event, (_, files) in sizes.items()}
+        )
     return tablesDF
 
 
+def glob_size(pathspec):
+    """
+    Total size and number of files matching pathspec. Lists each matching directory once and
+    sizes its files from the directory entries.
+    """
+    size = files = 0
+    pattern = os.path.basename(pathspec)
+    # Like glob, wildcards don't match hidden files
+    hidden = pattern.startswith(".")
+    for dirpath in iglob(os.path.dirname(pathspec)):
+        # The dir wildcards also match stray files (README, _SUCCESS) next to the partitions
+        if not os.path.isdir(dirpath):
+            continue
+        with os.scandir(dirpath) as entries:
+            for entry in entries:
+                if (
+                    (hidden or not entry.name.startswith("."))
+                    and fnmatch(entry.name, pattern)
+                    and entry.is_file()
+                ):
+                    size += entry.stat().st_size
+                    files += 1
+    return size, files
+
+
 def fetch_summary_data(con, hostname="%", agent_id="%"):
     # To get mixed-case column names in the DF, use "". But to use strings in the WHERE, use ''.
-    sql = (
-        'select "Event", "Hostname",bin_date as BinDT,"NumRows" from event_summary_raw_v1'
-        + f" where hostname ilike '%{hostname}%' and agentid ilike '%{agent_id}%' order by all"
+    # Calcuate "robust" scaling. The view has ALL event types so, scale each event by its own stats.
+    # Max size for circle marker should be ~600. Calculate multiplier to use based on max robust value.
+    # Hmm, need positive values for a sensible marker size. Shift'em. Note: min is assumed to always be < 0.
+    sql = f"""
+    with robust as (
+        select "Event", "Hostname", bin_date as BinDT, "NumRows",
+            ("NumRows" - median("NumRows") over event)
+                / (quantile_cont("NumRows", 0.75) over event - quantile_cont("NumRows", 0.25) over event) as Robust
+        from event_summary_raw_v1
+        where hostname ilike '%{hostname}%' and agentid ilike '%{agent_id}%'
+        window event as (partition by "Event")
     )
+    select "Event", "Hostname", BinDT, "NumRows",
+        (Robust - min(Robust) over event + 0.5) * (600 / max(Robust) over event) as "NumRowsRobust"
+    from robust
+    window event as (partition by "Event")
+    order by "Event", "Hostname", BinDT, "NumRows"
+    """
     print(sql)
     eventDF = con.execute(sql).df()
-
-    # Calcuate "robust" scaling. eventDF has ALL event types so, need to handle that:
-    for event in eventDF["Event"].unique():
-        logging.debug(f"Event: {event}")
-        eventDF.loc[eventDF.Event == event, "NumRowsRobust"] = (
-            eventDF["NumRows"] - eventDF["NumRows"].median()
-        ) / (eventDF["NumRows"].quantile(0.75) - eventDF["NumRows"].quantile(0.25))
-        # Max size for circle marker should be ~600. Calculate multiplier to use based on max robust total_sizeue.
-        sizeMx = 600 / eventDF.loc[eventDF.Event == event, "NumRowsRobust"].max()
-        logging.debug(f"Min: {eventDF.loc[eventDF.Event==event,'NumRowsRobust'].min()}")
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
         logging.debug(
-            f"Med: {eventDF.loc[eventDF.Event==event,'NumRowsRobust'].median()}"
+            "Marker sizes per event:\n%s",
+            eventDF.groupby("Event")["NumRowsRobust"].agg(["min", "median", "max"]),
         )
-        logging.debug(f"Max: {eventDF.loc[eventDF.Event==event,'NumRowsRobust'].max()}")
-        # Hmm, need positive total_size for a sensible marker size. Shift'em. Note: min is assumed to always be < 0.
-        eventDF.loc[eventDF.Event == event, "NumRowsRobust"] = (
-            eventDF["NumRowsRobust"] + eventDF["NumRowsRobust"].min() * -1 + 0.5
-        ) * sizeMx
     return eventDF
 
 
@@ -3,12 +3,12 @@ Functions loading data from the standard view structure
 """
 
 import os
-import re
 from collections import defaultdict
 from datetime import datetime
 
 import altair as alt
 import pandas as pd
+import pyarrow.parquet as pq
 from dotenv import load_dotenv
 from humanfriendly import format_size
 from IPython.display import Markdown, display
@@ -36,7 +36,7 @@ def load_files_from_dataset(dataset_path):
         else:
             # Treat as a simple, single file.
             if event_type.lower().endswith("parquet"):
-                event = re.split(r"\.", event_type)[0]
+                event = event_type.partition(".")[0]
                 print(f"{datetime.now()} Loading {event} file: {event_type}")
                 batch[event].append(dataset_path + "/" + event_type)
     return batch
@@ -50,7 +50,10 @@ def load_data(batch):
     print(f"{datetime.now()}  Loading data into pandas")
     batchdf = {}
     for event_type, files in batch.items():
-        batchdf[f"{event_type}"] = pd.read_parquet(files, engine="pyarrow")
+        # Release the arrow buffers as they're converted, rather than holding both copies until the end.
+        batchdf[f"{event_type}"] = pq.read_table(files, use_threads=True).to_pandas(
+            split_blocks=True, self_destruct=True
+        )
     return batchdf
 
 
@@ -103,11 +106,11 @@ class WintapDataset:
         ]
 
     def search_process_name_in(self, term_list):
-        found = pd.DataFrame()
-        for term in term_list:
-            found = pd.concat([found, self.search_process_name(term)])
-
-        return found
+        # Concat once, growing the frame per term copies it every time.
+        found = [self.search_process_name(term) for term in term_list]
+        if not found:
+            return pd.DataFrame()
+        return pd.concat(found)
 
 
 ######## Various dataset display widgets for Jupyter
@@ -118,13 +121,14 @@ def data_summary(pandasdf):
     Display a short summary of a set of pandas
     """
     # Note: Markdown only seems to work when given the entire table. Fails if you try to use display(Markdown(a row)) iteratively
-    table = "| EventType | Rows | Memory\n"
-    table += "| :- | -: | -: |\n"
-
+    rows = ["| EventType | Rows | Memory", "| :- | -: | -: |"]
     for event_type in sorted(pandasdf):
-        table += f"| {event_type} | {pandasdf[event_type].shape[0]} | {format_size(pandasdf[event_type].memory_usage(index=True).sum())} \n"
+        df = pandasdf[event_type]
+        rows.append(
+            f"| {event_type} | {df.shape[0]} | {format_size(df.memory_usage(index=True).values.sum())} "
+        )
 
-    display(Markdown(table))
+    display(Markdown("\n".join(rows) + "\n"))
 
 
 def calc_event_summary(eventdf, dtfield, event_type):
@@ -13,34 +13,64 @@ of time.
 """
 
 import argparse
-import csv
+import json
 import logging
 import os
+import re
+import threading
+import time
 import traceback
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from dataclasses import asdict, dataclass
+from dataclasses import dataclass, fields
 from datetime import datetime, timedelta, timezone
-from functools import partial
+from functools import lru_cache, partial
 from pathlib import Path
+from typing import Optional
 
 import boto3
 import botocore
 import pyarrow as pa
 import pyarrow.parquet as pq
 import tqdm
+from boto3.s3.transfer import TransferConfig
+from s3transfer.processpool import ProcessPoolDownloader, ProcessTransferConfig
 
 from wintappy.config import EnvironmentConfig
 from wintappy.etlutils.utils import configure_basic_logging, get_date_range
 
-# Maximum number of open HTTP(s) connections
-MAX_POOL_CONNECTIONS = 50
 # Maximum S3 download threads
 MAX_WORKERS = 32
+# Maximum number of open HTTP(s) connections. Keep headroom over the worker count so retries and
+# ranged GETs don't overflow the pool and force new TLS handshakes.
+MAX_POOL_CONNECTIONS = max(MAX_WORKERS * 2, 128)
+# Connections per download thread's client, enough for the ranged GETs of one large object
+WORKER_POOL_CONNECTIONS = 10
+# Maximum S3 list threads
+LIST_WORKERS = 16
+# Keys requested per list_objects_v2 page (1000 is the S3 maximum)
+LIST_PAGE_SIZE = 1000
 # Maximum number of retries for failed downloads
 MAX_RETRIES = 3
-
-
-@dataclass
+# Size of the chunks streamed from S3 object bodies to disk
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# Objects at least this large are downloaded with parallel ranged GETs
+MULTIPART_THRESHOLD = 64 * 1024 * 1024
+# Wintap parquet filenames, both legacy (hostname=event_type-epoch) and new (hostname+event_type+epoch)
+FILENAME_RE = re.compile(
+    r"^(?:(?P<legacy_hostname>[^=]+)=[^-]*-(?P<legacy_epoch>\d+)"
+    r"|(?P<hostname>[^=+]+)\+[^+]*\+(?P<epoch>\d+))\."
+)
+# Transfer settings for large objects. "auto" uses the CRT transfer client when boto3[crt] is installed.
+LARGE_FILE_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=MULTIPART_THRESHOLD,
+    multipart_chunksize=16 * 1024 * 1024,
+    max_concurrency=WORKER_POOL_CONNECTIONS,
+    preferred_transfer_client="auto",
+)
+
+
+# Slotted and frozen: files_md can hold millions of these per event type sweep.
+@dataclass(slots=True, frozen=True)
 class S3File:
     key: str
     filename: str
@@ -55,54 +85,69 @@ class S3File:
     os: str
     sensor_version: str
     event_type: str
+    size: int = 0
 
     def dict(self):
-        return {k: str(v) for k, v in asdict(self).items()}
+        return {f.name: str(getattr(self, f.name)) for f in fields(self)}
 
 
 def list_files(s3_client, bucket, prefix):
     """
     Lists all files, at any folder level, under the given prefix.
-    No folders (CommonPrefixes) are returned as there is no delimiter given.
+    Returns a generator of (key, size) tuples. No folders (CommonPrefixes) are returned as there is no delimiter given.
     """
-    return _list_s3(s3_client, bucket, prefix, delimiter="")
+    for page in _list_s3(s3_client, bucket, prefix, delimiter=""):
+        yield from ((o["Key"], o.get("Size", 0)) for o in page.get("Contents", []))
 
 
 def list_folders(s3_client, bucket, prefix):
     """
-    Lists all folders (and files) at the given prefix level.
+    Lists all folders at the given prefix level as a list of prefix strings.
     Note that in practice, the Wintap S3 organization doesn't mix files/folders at the same level.
     """
-    return _list_s3(s3_client, bucket, prefix, delimiter="/")
+    return [
+        path["Prefix"]
+        for page in _list_s3(s3_client, bucket, prefix, delimiter="/")
+        for path in page.get("CommonPrefixes", [])
+    ]
 
 
 def _list_s3(s3_client, bucket, prefix, delimiter="/"):
     """
-    Get files/folders metadata from a specific S3 prefix.
+    Get the pages of files/folders metadata from a specific S3 prefix.
     """
-    file_names = []
-    folders = []
-
-    kwargs = {"Bucket": bucket, "Prefix": prefix, "Delimiter": delimiter}
-    next_token = ""
+    paginator = s3_client.get_paginator("list_objects_v2")
+    yield from paginator.paginate(
+        Bucket=bucket,
+        Prefix=prefix,
+        Delimiter=delimiter,
+        PaginationConfig={"PageSize": LIST_PAGE_SIZE},
+    )
 
-    while next_token is not None:
-        if next_token != "":
-            kwargs["ContinuationToken"] = next_token
 
-        response = s3_client.list_objects_v2(**kwargs)
-        files = response.get("Contents")
-        paths = response.get("CommonPrefixes")
-        if paths != None:
-            for path in paths:
-                folders.append(path)
+def local_filename(s3_file: S3File) -> str:
+    """
+    Fully-qualified local filename for an S3 object.
+    """
+    # Replace '=' in filename to avoid DuckDB mistaking it for a key=value pair.
+    # Prefix event_type with 'raw_'
+    # TODO: This is fixed in Wintap. Still here for legacy data.
+    if "=" in s3_file.filename:
+        new_filename = s3_file.filename.replace("=", "+raw_")
+    else:
+        new_filename = s3_file.filename
+    return os.path.join(s3_file.local_file_path, new_filename)
 
-        if files != None:
-            for file in files:
-                file_names.append(file)
 
-        next_token = response.get("NextContinuationToken")
-    return file_names, folders
+def list_hour_prefixes(s3_client, bucket, event_prefix, daypk):
+    """
+    Get the set of uploadedHPK prefixes that exist for one uploadedDPK of an event type.
+    """
+    return set(
+        list_folders(
+            s3_client, bucket=bucket, prefix=f"{event_prefix}uploadedDPK={daypk}/"
+        )
+    )
 
 
 def download_one_file(bucket: str, client: boto3.client, s3_file: S3File):
@@ -113,62 +158,262 @@ def download_one_file(bucket: str, client: boto3.client, s3_file: S3File):
         client (boto3.client): S3 client
         s3_file (S3File): S3 object metadata
     """
-    make_dirs(s3_file)
-    # Replace '=' in filename to avoid DuckDB mistaking it for a key=value pair.
-    # Prefix event_type with 'raw_'
-    # TODO: This is fixed in Wintap. Still here for legacy data.
-    if "=" in s3_file.filename:
-        new_filename = s3_file.filename.replace("=", "+raw_")
-    else:
-        new_filename = s3_file.filename
-    client.download_file(
-        Bucket=bucket,
-        Key=s3_file.key,
-        Filename=os.path.join(s3_file.local_file_path, new_filename),
-    )
+    local_file = local_filename(s3_file)
+    if s3_file.size >= MULTIPART_THRESHOLD:
+        # Large objects: let the transfer manager split the download into parallel ranged GETs.
+        client.download_file(
+            Bucket=bucket,
+            Key=s3_file.key,
+            Filename=local_file,
+            Config=LARGE_FILE_TRANSFER_CONFIG,
+        )
+        return
+    # Stream the object body straight to disk. Most Wintap files are small, so this avoids the
+    # per-call transfer manager (and its own thread pool) that client.download_file sets up.
+    # Write to a temporary name so a failed download never leaves a truncated parquet behind.
+    part_file = f"{local_file}.part"
+    body = client.get_object(Bucket=bucket, Key=s3_file.key)["Body"]
+    try:
+        with open(part_file, "wb") as f:
+            for chunk in body.iter_chunks(DOWNLOAD_CHUNK_SIZE):
+                f.write(chunk)
+        os.replace(part_file, local_file)
+    except Exception:
+        if os.path.exists(part_file):
+            os.remove(part_file)
+        raise
+    finally:
+        # Release the connection right away rather than when the body is garbage collected,
+        # so a failed read can't hold a slot in the keep-alive pool.
+        body.close()
+
+
+class ThreadLocalClient:
+    """
+    Callable that returns an S3 client owned by the calling thread, so download threads don't
+    contend on one client's connection pool and locks. Clients are created on first use.
+    """
+
+    def __init__(self, session: boto3.Session, **client_kwargs):
+        self._session = session
+        self._client_kwargs = client_kwargs
+        self._local = threading.local()
+        # boto3 sessions aren't safe to create clients from concurrently
+        self._lock = threading.Lock()
+
+    def __call__(self) -> boto3.client:
+        client = getattr(self._local, "client", None)
+        if client is None:
+            with self._lock:
+                client = self._session.client("s3", **self._client_kwargs)
+            self._local.client = client
+        return client
+
+
+def download_with_thread_client(
+    bucket: str, get_client: ThreadLocalClient, s3_file: S3File
+):
+    download_one_file(bucket, get_client(), s3_file)
+
+
+class FailureLog:
+    """
+    JSON lines file of failed downloads, one line per failed attempt, appended as each failure
+    happens so the record survives a crash or interrupt. Each line is the S3 file plus the
+    retry_attempt it failed on. Files whose last line has retry_attempt == MAX_RETRIES failed
+    for good.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = (
+            path or f"failed_downloads_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl"
+        )
+        # Failures are reported from the download threads
+        self._lock = threading.Lock()
+
+    def write(self, s3_file: S3File, retry_attempt: int) -> None:
+        line = json.dumps({**s3_file.dict(), "retry_attempt": retry_attempt}) + "\n"
+        with self._lock:
+            # Opened per failure, so every line is on disk without holding the file open
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
 
 
 def download_files_threaded(
-    bucket: str, client: boto3.client, s3_files, retry_attempt: int = 0
+    bucket: str,
+    get_client: ThreadLocalClient,
+    s3_files,
+    retry_attempt: int = 0,
+    max_workers: int = MAX_WORKERS,
+    failure_log: Optional[FailureLog] = None,
 ):
     """
     Download files from S3 into the provided root path.
     Files are written to folders based on the timestamp they were collected, not uploaded.
     Multi-threaded, TQDM progress output.
     """
+    failure_log = failure_log or FailureLog()
 
-    # The client is shared between threads
-    func = partial(download_one_file, bucket, client)
+    # Each thread uses its own client
+    func = partial(download_with_thread_client, bucket, get_client)
+    make_dirs(s3_files)
 
     # List for storing possible failed downloads to retry later
     failed_downloads = []
 
     with tqdm.tqdm(desc="Downloading files from S3", total=len(s3_files)) as pbar:
-        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
             # Using a dict for preserving the downloaded file for each future, to store it as a failure if we need that
             futures = {executor.submit(func, s3_file): s3_file for s3_file in s3_files}
             for future in as_completed(futures):
                 if future.exception():
                     failed_downloads.append(futures[future])
+                    failure_log.write(futures[future], retry_attempt)
                     logging.error(future.exception())
                 pbar.update(1)
+    retry_failed_downloads(
+        failed_downloads,
+        retry_attempt,
+        partial(
+            download_files_threaded,
+            bucket,
+            get_client,
+            max_workers=max_workers,
+            failure_log=failure_log,
+        ),
+        failure_log,
+    )
+
+
+class DownloadStream:
+    """
+    Download files on a thread pool as they are submitted, so downloads start while the
+    listing is still running. Submitting blocks once max_pending downloads are queued, so
+    the producer doesn't buffer an entire sweep of pending work.
+    Multi-threaded, TQDM progress output.
+    """
+
+    def __init__(
+        self,
+        bucket: str,
+        get_client: ThreadLocalClient,
+        max_workers: int = MAX_WORKERS,
+        max_pending: Optional[int] = None,
+        failure_log: Optional[FailureLog] = None,
+    ):
+        self.bucket = bucket
+        self.get_client = get_client
+        self.failure_log = failure_log or FailureLog()
+        self.failed_downloads = []
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._pending = threading.BoundedSemaphore(max_pending or max_workers * 4)
+        self._lock = threading.Lock()
+        self._dirs = set()
+        self._pbar = tqdm.tqdm(desc="Downloading files from S3", total=0)
+
+    def submit(self, s3_files) -> None:
+        make_dirs(f for f in s3_files if f.local_file_path not in self._dirs)
+        self._dirs.update(f.local_file_path for f in s3_files)
+        with self._lock:
+            self._pbar.total += len(s3_files)
+            self._pbar.refresh()
+        for s3_file in s3_files:
+            self._pending.acquire()
+            future = self._executor.submit(
+                download_with_thread_client, self.bucket, self.get_client, s3_file
+            )
+            future.add_done_callback(partial(self._done, s3_file))
+
+    def _done(self, s3_file: S3File, future) -> None:
+        with self._lock:
+            if future.exception():
+                self.failed_downloads.append(s3_file)
+                self.failure_log.write(s3_file, 0)
+                logging.error(future.exception())
+            self._pbar.update(1)
+        self._pending.release()
+
+    def close(self):
+        """
+        Wait for the submitted downloads to finish. Returns the files that failed.
+        """
+        self._executor.shutdown(wait=True)
+        self._pbar.close()
+        return self.failed_downloads
+
+
+def download_files_processpool(
+    bucket: str,
+    client_kwargs: dict,
+    s3_files,
+    retry_attempt: int = 0,
+    max_workers: int = MAX_WORKERS,
+    failure_log: Optional[FailureLog] = None,
+):
+    """
+    Download files from S3 into the provided root path.
+    Files are written to folders based on the timestamp they were collected, not uploaded.
+    Multi-process, TQDM progress output. Each worker process has its own client and interpreter,
+    so any per-file processing isn't serialized on the GIL.
+    """
+    failure_log = failure_log or FailureLog()
+    # List for storing possible failed downloads to retry later
+    failed_downloads = []
+
+    config = ProcessTransferConfig(max_request_processes=max_workers)
+    make_dirs(s3_files)
+    with tqdm.tqdm(desc="Downloading files from S3", total=len(s3_files)) as pbar:
+        with ProcessPoolDownloader(
+            client_kwargs=client_kwargs, config=config
+        ) as downloader:
+            futures = []
+            for s3_file in s3_files:
+                future = downloader.download_file(
+                    bucket, s3_file.key, local_filename(s3_file)
+                )
+                futures.append((future, s3_file))
+            for future, s3_file in futures:
+                try:
+                    future.result()
+                except Exception as e:
+                    failed_downloads.append(s3_file)
+                    failure_log.write(s3_file, retry_attempt)
+                    logging.error(e)
+                pbar.update(1)
+    retry_failed_downloads(
+        failed_downloads,
+        retry_attempt,
+        partial(
+            download_files_processpool,
+            bucket,
+            client_kwargs,
+            max_workers=max_workers,
+            failure_log=failure_log,
+        ),
+        failure_log,
+    )
+
+
+def retry_failed_downloads(
+    failed_downloads,
+    retry_attempt: int,
+    download_func,
+    failure_log: FailureLog,
+):
+    """
+    Retry failed downloads with the given download function until MAX_RETRIES is reached.
+    Each failure is already in the failure log, this reports whatever still failed.
+    """
     if len(failed_downloads) > 0:
         if retry_attempt < MAX_RETRIES:
             logging.warning(
                 f"  {len(failed_downloads)} downloads have failed. Retrying."
             )
-            download_files_threaded(bucket, client, failed_downloads, retry_attempt + 1)
+            download_func(failed_downloads, retry_attempt + 1)
         else:
             logging.warning(
-                f"  {len(failed_downloads)} downloads have failed. Writing to CSV."
+                f"  {len(failed_downloads)} downloads have failed. Recorded in {failure_log.path}."
             )
-            with open(
-                os.path.join(".", f"failed_downloads_{datetime.now()}.csv"),
-                "w",
-                newline="",
-            ) as csvfile:
-                wr = csv.writer(csvfile, quoting=csv.QUOTE_ALL)
-                wr.writerow(failed_downloads)
 
 
 def download_files(bucket_name, s3_client, s3_files):
@@ -178,8 +423,8 @@ def download_files(bucket_name, s3_client, s3_files):
     Single-threaded, simple progress output.
     """
     count = 0
+    make_dirs(s3_files)
     for s3_file in s3_files:
-        make_dirs(s3_file)
         download_one_file(bucket_name, s3_client, s3_file)
         count += 1
         if count % 1000 == 0:
@@ -187,11 +432,14 @@ def download_files(bucket_name, s3_client, s3_files):
     logging.info(f"    Downloaded: {count}")
 
 
-def make_dirs(s3_file):
-    if not os.path.exists(s3_file.local_file_path):
-        # When multithreaded, another thread may beat us to creating the path
-        os.makedirs(s3_file.local_file_path, exist_ok=True)
-        logging.debug("folder '{}' created ".format(s3_file.local_file_path))
+def make_dirs(s3_files):
+    """
+    Create the local partition folders for a batch of files up front. Many files share an
+    hour partition, so only the unique paths are created.
+    """
+    for local_file_path in {s3_file.local_file_path for s3_file in s3_files}:
+        os.makedirs(local_file_path, exist_ok=True)
+        logging.debug("folder '{}' created ".format(local_file_path))
 
 
 def hour_range(start_date, end_date):
@@ -204,17 +452,43 @@ def hour_range(start_date, end_date):
 
 def parse_filename(filename):
     """
-    Legacy format: hostname=event_type+epoch_ts.parquet
+    Legacy format: hostname=event_type-epoch_ts.parquet
     New format:    hostname+event_type+epoch_ts.parquet
     """
-    if "=" in filename:
-        hostname = filename.split("=")[0]
-        data_capture_epoch = filename.split("=")[1].rsplit("-")[1].split(".")[0]
-    else:
-        hostname = filename.split("+")[0]
-        # Drop the '.parquet' also
-        data_capture_epoch = filename.split("+")[2].split(".")[0]
-    return hostname, data_capture_epoch
+    match = FILENAME_RE.match(filename)
+    if match is None:
+        raise ValueError(f"Unrecognized Wintap filename: {filename}")
+    if match["legacy_hostname"] is not None:
+        return match["legacy_hostname"], match["legacy_epoch"]
+    return match["hostname"], match["epoch"]
+
+
+@lru_cache(maxsize=65536)
+def capture_partition(data_capture_epoch: str) -> tuple[datetime, str, str]:
+    """
+    Convert a capture epoch to its timestamp and dayPK/hourPK. Files from the same host/hour
+    share epochs, so this is cached.
+    """
+    epoch = int(data_capture_epoch)
+    tm = time.gmtime(epoch)
+    return (
+        datetime.fromtimestamp(epoch, timezone.utc),
+        time.strftime("%Y%m%d", tm),
+        time.strftime("%H", tm),
+    )
+
+
+@lru_cache(maxsize=None)
+def local_partition_path(
+    dataset: str, event_type: str, datadpk: str, datahpk: str
+) -> str:
+    """
+    Local directory for an event type's day/hour partition. Cached so the many files in one
+    partition share a single path string.
+    """
+    return os.path.join(
+        dataset, "raw_sensor", event_type, f"dayPK={datadpk}", f"hourPK={datahpk}"
+    )
 
 
 def parse_s3_metadata(files, dataset, uploadedDPK, uploadedHPK, event_type):
@@ -241,15 +515,11 @@ def parse_s3_metadata(files, dataset, uploadedDPK, uploadedHPK, event_type):
 
     files_metadata = []
     back_dated = {}
-    for file in files:
+    for key, size in files:
         try:
-            (s3_path, _, filename) = file.get("Key").rpartition("/")
+            (s3_path, _, filename) = key.rpartition("/")
             hostname, data_capture_epoch = parse_filename(filename)
-            data_capture_ts = datetime.fromtimestamp(
-                int(data_capture_epoch), timezone.utc
-            )
-            datadpk = data_capture_ts.strftime("%Y%m%d")
-            datahpk = data_capture_ts.strftime("%H")
+            data_capture_ts, datadpk, datahpk = capture_partition(data_capture_epoch)
             # Data date can be different! Thats ok, it just means the host got delayed sending for some reason.
             # TODO: Come up with a "dirty" flag to indicate that backdated data was found so rolling/stdview can be updated
             if datadpk != uploadedDPK or datahpk != uploadedHPK:
@@ -259,10 +529,12 @@ def parse_s3_metadata(files, dataset, uploadedDPK, uploadedHPK, event_type):
                 )
 
             # Define fully-qualified local name
-            local_file_path = f"{dataset}/raw_sensor/{new_event_type}/dayPK={datadpk}/hourPK={datahpk}"
+            local_file_path = local_partition_path(
+                dataset, new_event_type, datadpk, datahpk
+            )
 
             s3File = S3File(
-                file.get("Key"),
+                key,
                 filename,
                 s3_path,
                 hostname,
@@ -275,6 +547,7 @@ def parse_s3_metadata(files, dataset, uploadedDPK, uploadedHPK, event_type):
                 "windows",
                 "v2",
                 event_type,
+                size,
             )
             files_metadata.append(s3File)
         except Exception as e:
@@ -285,11 +558,55 @@ def parse_s3_metadata(files, dataset, uploadedDPK, uploadedHPK, event_type):
     return files_metadata
 
 
+def list_s3_metadata(
+    s3_client, bucket, prefix, dataset, uploadedDPK, uploadedHPK, event_type
+):
+    """
+    List and parse the files under one uploadedDPK/uploadedHPK prefix.
+    Keys are parsed as each list page arrives rather than collecting the full listing first.
+    """
+    return parse_s3_metadata(
+        list_files(s3_client, bucket, prefix),
+        dataset,
+        uploadedDPK,
+        uploadedHPK,
+        event_type,
+    )
+
+
 def main(argv=None) -> None:
     configure_basic_logging()
     parser = argparse.ArgumentParser(
         prog="downloadfromS3.py", description="Download Wintap files from S3"
     )
+    # options that are specific to this cli tool
+    parser.add_argument(
+        "--executor",
+        help="Download using a pool of threads or a pool of processes",
+        choices=["thread", "process"],
+        default="thread",
+    )
+    parser.add_argument(
+        "--max-workers",
+        help=f"Maximum number of concurrent downloads (default: {MAX_WORKERS})",
+        type=int,
+        default=MAX_WORKERS,
+    )
+    parser.add_argument(
+        "--list-workers",
+        help=f"Number of concurrent S3 list requests (default: {LIST_WORKERS})",
+        type=int,
+        default=LIST_WORKERS,
+    )
+    parser.add_argument(
+        "--max-conn",
+        help=f"Maximum number of open S3 connections, split evenly across the download threads (default: {MAX_POOL_CONNECTIONS} for listing, or 2x max-workers if larger, and {WORKER_POOL_CONNECTIONS} per download thread)",
+        type=int,
+    )
+    parser.add_argument(
+        "--failure-log",
+        help="JSON lines file failed downloads are appended to as they happen, with the retry attempt (default: ./failed_downloads_<timestamp>.jsonl)",
+    )
     env_config = EnvironmentConfig(parser)
     env_config.add_aws_settings(required=True)
     env_config.add_start(required=True)
@@ -302,28 +619,37 @@ def main(argv=None) -> None:
         session = boto3.Session(profile_name=args.AWS_PROFILE)
     else:
         session = boto3.Session()
-    if args.AWS_REGION:
-        s3 = session.client(
-            "s3",
-            config=botocore.client.Config(max_pool_connections=50),
-            region_name=args.AWS_REGION,
-        )
-    else:
-        s3 = session.client(
-            "s3", config=botocore.client.Config(max_pool_connections=50)
-        )
+    client_config = botocore.client.Config(
+        max_pool_connections=args.get(
+            "MAX_CONN", max(args.MAX_WORKERS * 2, MAX_POOL_CONNECTIONS)
+        ),
+        retries={"mode": "adaptive", "max_attempts": 10},
+        tcp_keepalive=True,
+    )
+    region_kwargs = {"region_name": args.AWS_REGION} if args.AWS_REGION else {}
+    s3 = session.client("s3", config=client_config, **region_kwargs)
+    # Download threads each get their own client, so split the connection budget between them
+    get_client = ThreadLocalClient(
+        session,
+        config=client_config.merge(
+            botocore.client.Config(
+                max_pool_connections=(
+                    max(1, args.MAX_CONN // args.MAX_WORKERS)
+                    if args.get("MAX_CONN")
+                    else WORKER_POOL_CONNECTIONS
+                )
+            )
+        ),
+        **region_kwargs,
+    )
 
     top_level_prefix = (
         args.AWS_S3_PREFIX
         if args.AWS_S3_PREFIX.endswith("/")
         else f"{args.AWS_S3_PREFIX}/"
     )
-    files, folders = list_folders(
-        s3, bucket=args.AWS_S3_BUCKET, prefix=top_level_prefix
-    )
-
     # Top level is event types
-    event_types = folders
+    event_types = list_folders(s3, bucket=args.AWS_S3_BUCKET, prefix=top_level_prefix)
     start_date, end_date = get_date_range(
         args.START, args.END, date_format="%Y%m%d %H", data_set_path=args.DATASET
     )
@@ -334,53 +660,84 @@ def main(argv=None) -> None:
         end_date = datetime(end.year, end.month, end.day)
 
     logging.info(f"Using time range: {start_date} -> {end_date}")
-    for event_type in event_types:
-        logging.info(f'S3 EventType Prefix: {event_type.get("Prefix")}')
+    # With the thread executor, files are downloaded as soon as each hour is listed
+    failure_log = FailureLog(args.get("FAILURE_LOG"))
+    downloader = (
+        None
+        if args.EXECUTOR == "process"
+        else DownloadStream(
+            args.AWS_S3_BUCKET,
+            get_client,
+            max_workers=args.MAX_WORKERS,
+            failure_log=failure_log,
+        )
+    )
+    for event_prefix in event_types:
+        event_type = get_event_type(event_prefix)
+        logging.info(f"S3 EventType Prefix: {event_prefix}")
         # Within an event type, iterate over date range by hour
+        hours = [
+            (single_date.strftime("%Y%m%d"), single_date.strftime("%H"))
+            for single_date in hour_range(start_date, end_date)
+        ]
         files_md = []
-        for single_date in hour_range(start_date, end_date):
-            daypk = single_date.strftime("%Y%m%d")
-            hourpk = single_date.strftime("%H")
-            logging.debug(f"daypk={daypk}; hourpk={hourpk}")
-
-            # Note: 'Prefix' includes a trailing slash.
-            prefix = (
-                f"{event_type.get('Prefix')}uploadedDPK={daypk}/uploadedHPK={hourpk}/"
-            )
-
-            # Optimization: many event types are sparsely populated, so enumerate the dayPK/hourPK structure, then just get files from the ones that exist.
-            files_tmp, existing_S3_paths = list_folders(
-                s3,
-                bucket=args.AWS_S3_BUCKET,
-                prefix=f"{event_type.get('Prefix')}uploadedDPK={daypk}/",
+        with ThreadPoolExecutor(max_workers=args.LIST_WORKERS) as executor:
+            # Optimization: many event types are sparsely populated, so enumerate the dayPK/hourPK structure,
+            # then just get files from the ones that exist. The days are listed once for the event type,
+            # then the hours of each existing day are listed concurrently.
+            existing_days = set(
+                list_folders(s3, bucket=args.AWS_S3_BUCKET, prefix=event_prefix)
             )
-            # list_folders returns a JSON list. Extract the paths as a simple string list
-            existing_S3_paths = [x.get("Prefix") for x in existing_S3_paths]
-            if prefix in existing_S3_paths:
-                files, folders = list_files(
-                    s3, bucket=args.AWS_S3_BUCKET, prefix=prefix
+            existing_S3_paths = set().union(
+                *executor.map(
+                    partial(list_hour_prefixes, s3, args.AWS_S3_BUCKET, event_prefix),
+                    sorted(
+                        {
+                            daypk
+                            for daypk, _ in hours
+                            if f"{event_prefix}uploadedDPK={daypk}/" in existing_days
+                        }
+                    ),
                 )
-                if len(files) > 0 or len(folders) > 0:
-                    logging.debug(f"  {prefix}")
-                    logging.debug(f"    Files: {len(files)}  Folders: {len(folders)}")
-                    files_md.extend(
-                        parse_s3_metadata(
-                            files,
-                            args.DATASET,
-                            daypk,
-                            hourpk,
-                            get_event_type(event_type),
-                        )
+            )
+            futures = {}
+            for daypk, hourpk in hours:
+                logging.debug(f"daypk={daypk}; hourpk={hourpk}")
+                # Note: 'Prefix' includes a trailing slash.
+                prefix = f"{event_prefix}uploadedDPK={daypk}/uploadedHPK={hourpk}/"
+                if prefix in existing_S3_paths:
+                    future = executor.submit(
+                        list_s3_metadata,
+                        s3,
+                        args.AWS_S3_BUCKET,
+                        prefix,
+                        args.DATASET,
+                        daypk,
+                        hourpk,
+                        event_type,
                     )
-                logging.info(
-                    f"  {prefix}  Files: {len(files)}  Folders: {len(folders)}  Total: {len(files_md)}"
-                )
-            else:
-                logging.debug(f"  {prefix} not in S3, skipping")
+                    futures[future] = prefix
+                else:
+                    logging.debug(f"  {prefix} not in S3, skipping")
+
+            for future in as_completed(futures):
+                prefix = futures[future]
+                files = future.result()
+                files_md.extend(files)
+                logging.info(f"  {prefix}  Files: {len(files)}  Total: {len(files_md)}")
+                if downloader is not None:
+                    downloader.submit(files)
 
         if len(files_md) > 0:
-            logging.info(f"   Downloading {len(files_md)}...")
-            download_files_threaded(args.AWS_S3_BUCKET, s3, files_md)
+            if downloader is None:
+                logging.info(f"   Downloading {len(files_md)}...")
+                download_files_processpool(
+                    args.AWS_S3_BUCKET,
+                    process_client_kwargs(session, args.AWS_REGION),
+                    files_md,
+                    max_workers=args.MAX_WORKERS,
+                    failure_log=failure_log,
+                )
 
             # Write metadata
             # Ugly conversion to list of dicts to be able to easily create parquet.
@@ -391,12 +748,50 @@ def main(argv=None) -> None:
             Path(f"{args.DATASET}/s3_metadata").mkdir(parents=True, exist_ok=True)
             pq.write_table(
                 s3_table,
-                f'{args.DATASET}/s3_metadata/s3_metadata-{get_event_type(event_type)}-{args.START.replace(" ","_")}-{args.END.replace(" ","_")}.parquet',
+                f'{args.DATASET}/s3_metadata/s3_metadata-{event_type}-{args.START.replace(" ","_")}-{args.END.replace(" ","_")}.parquet',
             )
 
+    if downloader is not None:
+        retry_failed_downloads(
+            downloader.close(),
+            0,
+            partial(
+                download_files_threaded,
+                args.AWS_S3_BUCKET,
+                get_client,
+                max_workers=args.MAX_WORKERS,
+                failure_log=failure_log,
+            ),
+            failure_log,
+        )
+
 
-def get_event_type(event_type):
-    return event_type.get("Prefix").split("/")[2]
+def process_client_kwargs(session: boto3.Session, region: str) -> dict:
+    """
+    Client arguments for download worker processes. Each process builds its own client and
+    can't share the boto3 session, so resolve the credentials here. If the session has none,
+    the workers are left to find their own through the default credential chain.
+    """
+    client_kwargs = {}
+    credentials = session.get_credentials()
+    if credentials is None:
+        logging.warning(
+            "No AWS credentials found in the session, workers will resolve their own"
+        )
+    else:
+        credentials = credentials.get_frozen_credentials()
+        client_kwargs = {
+            "aws_access_key_id": credentials.access_key,
+            "aws_secret_access_key": credentials.secret_key,
+            "aws_session_token": credentials.token,
+        }
+    if region:
+        client_kwargs["region_name"] = region
+    return client_kwargs
+
+
+def get_event_type(event_prefix):
+    return event_prefix.split("/")[2]
 
 
 if __name__ == "__main__":
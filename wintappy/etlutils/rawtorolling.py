@@ -14,7 +14,7 @@ def process_range(
     for single_date in daterange(start_date, end_date):
         daypk = single_date.strftime("%Y%m%d")
         con = ru.init_db()
-        globs = ru.get_globs_for(cur_dataset, daypk)
+        globs = ru.get_globs_for(cur_dataset, daypk, con)
         # No need to pass dayPK as the globs already include it.
         # TODO Skip processing of raw_memorymap to save some time...
         for skip_type in exclude_event_types:
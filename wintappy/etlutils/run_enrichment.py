@@ -23,10 +23,12 @@ from wintappy.etlutils.utils import configure_basic_logging, daterange, get_date
 
 
 def add_enrichment_tables(
-    manager: TransformerManager, enrichment_location: str
+    manager: TransformerManager,
+    enrichment_location: str,
+    refresh_metadata: bool = False,
 ) -> None:
     # setup metadata tables
-    mitre_attack_data = load_attack_metadata()
+    mitre_attack_data = load_attack_metadata(refresh=refresh_metadata)
     metadata_tables = {
         CAR_ANALYTICS_TABLE: list(
             map(
@@ -62,20 +64,20 @@ def add_enrichment_tables(
         # Register the memory filesystem and create the table
         manager.wintap_duckdb.register_filesystem(fsspec.filesystem("memory"))
         if table_name in [TECHNIQUES_TABLE, TACTICS_TABLE]:
-            manager.wintap_duckdb.query(
+            manager.wintap_duckdb.execute(
                 f"CREATE TABLE IF NOT EXISTS {table_name_internal} AS SELECT * FROM read_json_auto('memory://{table_name_internal}.json')"
             )
             # Insert the data into the table
-            manager.wintap_duckdb.query(
+            manager.wintap_duckdb.execute(
                 f"INSERT INTO {table_name_internal} SELECT * FROM read_json_auto('memory://{table_name_internal}.json')"
             )
             # Now we need to unnest the data
-            manager.wintap_duckdb.query(
+            manager.wintap_duckdb.execute(
                 f"CREATE OR REPLACE VIEW {table_name} as select unnest(external_references).external_id as external_id, * from {table_name_internal}"
             )
         else:
-            manager.wintap_duckdb.query(f"DROP TABLE IF EXISTS {table_name}")
-            manager.wintap_duckdb.query(
+            manager.wintap_duckdb.execute(f"DROP TABLE IF EXISTS {table_name}")
+            manager.wintap_duckdb.execute(
                 f"CREATE TABLE IF NOT EXISTS {table_name} AS SELECT * FROM read_json_auto('memory://{table_name_internal}.json')"
             )
         # finally, write out the tables
@@ -125,6 +127,11 @@ def main(argv=None):
         help="Add enrichment tables to the specified path",
         default="",
     )
+    parser.add_argument(
+        "--refresh-metadata",
+        help="Re-fetch MITRE CAR/ATT&CK metadata from GitHub instead of using the local cache",
+        action="store_true",
+    )
     env_config = EnvironmentConfig(parser)
     env_config.add_start(required=False)
     env_config.add_end(required=False)
@@ -132,7 +139,11 @@ def main(argv=None):
     env_config.add_dataset_path(required=True)
     args = env_config.get_options(argv)
 
-    manager = TransformerManager(current_dataset=args.DATASET, agg_level=args.AGGLEVEL)
+    manager = TransformerManager(
+        current_dataset=args.DATASET,
+        agg_level=args.AGGLEVEL,
+        refresh_metadata=args.REFRESH_METADATA,
+    )
 
     start_date, end_date = get_date_range(args.START, args.END, agg_level=args.AGGLEVEL)
     if start_date and end_date:
@@ -141,7 +152,9 @@ def main(argv=None):
         process_table(manager)
 
     if args.POPULATE_ENRICHMENT_TABLES:
-        add_enrichment_tables(manager, args.POPULATE_ENRICHMENT_TABLES)
+        add_enrichment_tables(
+            manager, args.POPULATE_ENRICHMENT_TABLES, args.REFRESH_METADATA
+        )
 
 
 if __name__ == "__main__":
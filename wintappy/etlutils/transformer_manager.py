@@ -16,7 +16,9 @@ class TransformerManager:
     jinja_environment: Environment
     wintap_duckdb: WintapDuckDB
 
-    def __init__(self, current_dataset: str, agg_level: str = ""):
+    def __init__(
+        self, current_dataset: str, agg_level: str = "", refresh_metadata: bool = False
+    ):
         self.dataset_path = current_dataset
         con = None
         if agg_level:
@@ -28,7 +30,11 @@ class TransformerManager:
         ## basic setup for what we will use to run analytics
         options = WintapDuckDBOptions(con, path, load_analytics=False)
         self.wintap_duckdb = WintapDuckDB(options)
+        # Analytic templates are compiled once in load_all and the packaged files don't change
+        # during a run, so skip the per-lookup up-to-date checks.
         self.jinja_environment = Environment(
-            loader=PackageLoader("wintappy", package_path="./analytics/mitre_car/")
+            loader=PackageLoader("wintappy", package_path="./analytics/mitre_car/"),
+            cache_size=400,
+            auto_reload=False,
         )
-        self.analytics = load_all(self.jinja_environment)
+        self.analytics = load_all(self.jinja_environment, refresh=refresh_metadata)